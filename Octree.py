@@ -3,8 +3,11 @@ from panda3d.core import LVecBase3, LColor, LineSegs
 from direct.gui.DirectGui import DirectButton  
 
 from algo_octree import Octree
+from octree_log import get_logger
 import random
 
+log = get_logger("cubeapp")
+
 class CubeApp(ShowBase):
     def __init__(self):
         super().__init__()
@@ -17,6 +20,10 @@ class CubeApp(ShowBase):
         
 
         self.tam_cubo = 1
+        # el modelo de la esfera se carga una sola vez; cada punto es una instancia
+        self.esfera = self.loader.load_model("sphere3D/scene.gltf")
+        self.esfera.set_scale(0.02)
+        self.esfera.set_color(LColor(1, 1, 1, 0.1))
         self.cube = self.create_wireframe_cube(0, 0, 0, self.tam_cubo)
         self.octree = Octree((-self.tam_cubo / 2, -self.tam_cubo / 2, -self.tam_cubo / 2,
                               self.tam_cubo / 2, self.tam_cubo / 2, self.tam_cubo / 2), 2)
@@ -37,19 +44,17 @@ class CubeApp(ShowBase):
                  random.uniform(-self.tam_cubo / 2, self.tam_cubo / 2),
                  random.uniform(-self.tam_cubo / 2, self.tam_cubo / 2))
         if self.octree.insert(point):
-            print(f"Punto {point} agregado al octree.")
+            log.info("Punto %s agregado al octree.", point)
             self.draw_esfera(point)
             self.octree.visualizar(self.render)
         else:
-            print(f"Punto {point} fuera de los límites del octree.")
+            log.info("Punto %s fuera de los límites del octree.", point)
         
     def draw_esfera(self, posicion):
         """Dibuja una esfera en la posición dada."""
-        sphere = self.loader.load_model("sphere3D/scene.gltf")
-        sphere.set_scale(0.02)  
+        sphere = self.render.attach_new_node("esfera")
         sphere.set_pos(LVecBase3(*posicion))
-        sphere.reparent_to(self.render)
-        sphere.set_color(LColor(1, 1, 1, 0.1))  
+        self.esfera.instance_to(sphere)
         
     def create_wireframe_cube(self, x, y, z, size):
         """Crea un cubo con aristas visibles y caras transparentes."""
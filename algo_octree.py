@@ -3,66 +3,62 @@ from direct.showbase.ShowBase import ShowBase
 from panda3d.core import LVecBase3, LColor, LineSegs, TextNode
 from direct.gui.DirectGui import DirectButton  
 
+from octree_log import TRACE, Dump, get_logger
+from octree_render import BoxLines
+
+log = get_logger("algo")
+
 class Octree:
-    def __init__(self, boundary, capacidad, level=0):
+    __slots__ = ("boundary", "capacidad", "level", "max_depth", "min_node_size",
+                 "puntos", "divided", "subtrees", "wireframe", "sucio", "lineas")
+
+    def __init__(self, boundary, capacidad, level=0, max_depth=32, min_node_size=0.0):
         """
         Inicializa el octree.
         :param boundary: un cubo que define los límites del octree (xmin, ymin, zmin, xmax, ymax, zmax)
         :param capacidad: número máximo de puntos que el cubo puede contener antes de dividirse
+        :param level: profundidad del nodo (0 en la raíz)
+        :param max_depth: profundidad a partir de la cual los nodos ya no se dividen
+        :param min_node_size: un cubo con lado menor o igual a este tamaño ya no se divide
         """
         self.boundary = boundary  
         self.capacidad = capacidad
+        self.level = level
+        self.max_depth = max_depth
+        self.min_node_size = min_node_size
         self.puntos = []
         self.divided = False
         self.subtrees = []          
+        self.wireframe = None  # slot del cubo en el BoxLines de la raíz
+        self.sucio = True      # hay nodos sin dibujar en este subárbol
+        self.lineas = None     # BoxLines, solo en la raíz
 
-    def visualizar(self, render):
+    def visualizar(self, render, lineas=None):
         """
-        Visualiza el cubo actual y sus subcubos si están divididos.
+        Visualiza el cubo actual y sus subcubos si están divididos.  Todos los
+        cubos van en un solo ``BoxLines`` (una sola geometría) que guarda la
+        raíz; solo se agregan los cubos nuevos y solo se recorren los
+        subárboles que cambiaron desde la última llamada.
         :param render: gestiona todos los elementos de la escena 
+        :param lineas: uso interno, el ``BoxLines`` de la raíz
         """
-        
-        self.draw_cube(self.boundary, render)
-        
-        
-        if self.divided:
-            for subtree in self.subtrees:
-                subtree.visualizar(render)
-                
-    def draw_cube(self, boundary, render):
-        """Dibuja el cubo a partir de sus límites."""
-        xmin, ymin, zmin, xmax, ymax, zmax = boundary
-
-        
-        line_segs = LineSegs()
-        line_segs.set_thickness(2)
-        line_segs.set_color(LColor(1, 1, 0, 1))  
+        raiz = lineas is None
+        if raiz:
+            if self.lineas is None:
+                self.lineas = BoxLines(render, color=(1, 1, 0, 1), name="algo_octree")
+            lineas = self.lineas
 
-        
-        vertices = [
-            (xmin, ymin, zmin), (xmax, ymin, zmin),
-            (xmax, ymax, zmin), (xmin, ymax, zmin),
-            (xmin, ymin, zmax), (xmax, ymin, zmax),
-            (xmax, ymax, zmax), (xmin, ymax, zmax)
-        ]   
+        if self.sucio:
+            if self.wireframe is None:
+                self.wireframe = lineas.add(self.boundary[:3], self.boundary[3:])
+            if self.divided:
+                for subtree in self.subtrees:
+                    if subtree is not None:
+                        subtree.visualizar(render, lineas)
+            self.sucio = False
 
-        
-        edges = [
-            (0, 1), (1, 2), (2, 3), (3, 0),  
-            (4, 5), (5, 6), (6, 7), (7, 4),  
-            (0, 4), (1, 5), (2, 6), (3, 7)   
-        ]
-
-        
-        for edge in edges:
-            start, end = edge
-            line_segs.move_to(vertices[start])
-            line_segs.draw_to(vertices[end])
-
-        
-        wireframe = line_segs.create()
-        wireframe_node = render.attach_new_node(wireframe)
-        wireframe_node.set_pos(0, 0, 0)  
+        if raiz:
+            lineas.flush()
 
     def insert(self, point):
         """
@@ -72,22 +68,19 @@ class Octree:
         """
         if not self.contains(point):
             return False
+        self.sucio = True
 
-        if len(self.puntos) < self.capacidad:
+        if len(self.puntos) < self.capacidad or (not self.divided and not self.can_split()):
+            # un nodo que no se puede dividir guarda todo lo que le llegue
             self.puntos.append(point)
-            
-            print("punyo agrgado")
-            self.imprimir_nodos_compacto()
+            log.debug("punto agregado %s en el nivel %d", point, self.level)
+            log.log(TRACE, "nodo:\n%s", Dump(self.nodos_compactos, self.level))
             return True
         else:
             if not self.divided:
                 self.subdivide()
 
-            for subtree in self.subtrees:
-                if subtree.insert(point):
-                    return True
-                
-        return False
+            return self.hijo(self.indice_hijo(point)).insert(point)
     
     def contains(self, point):
         """
@@ -97,52 +90,65 @@ class Octree:
         xmin, ymin, zmin, xmax, ymax, zmax = self.boundary
         return (xmin <= x < xmax) and (ymin <= y < ymax) and (zmin <= z < zmax)
 
-    def subdivide(self):
-        """Divide el cubo en ocho subcubos."""
+    def can_split(self):
+        """Indica si el cubo todavía puede dividirse (profundidad y tamaño mínimo)."""
         xmin, ymin, zmin, xmax, ymax, zmax = self.boundary
-        xmid = (xmin + xmax) / 2
-        ymid = (ymin + ymax) / 2
-        zmid = (zmin + zmax) / 2
+        lado = max(xmax - xmin, ymax - ymin, zmax - zmin)
+        return self.level < self.max_depth and lado > self.min_node_size
 
-        
-        self.subtrees.append(Octree((xmin, ymin, zmin, xmid, ymid, zmid), self.capacidad))
-        self.subtrees.append(Octree((xmid, ymin, zmin, xmax, ymid, zmid), self.capacidad))
-        self.subtrees.append(Octree((xmin, ymid, zmin, xmid, ymax, zmid), self.capacidad))
-        self.subtrees.append(Octree((xmid, ymid, zmin, xmax, ymax, zmid), self.capacidad))
-        self.subtrees.append(Octree((xmin, ymin, zmid, xmid, ymid, zmax), self.capacidad))
-        self.subtrees.append(Octree((xmid, ymin, zmid, xmax, ymid, zmax), self.capacidad))
-        self.subtrees.append(Octree((xmin, ymid, zmid, xmid, ymax, zmax), self.capacidad))
-        self.subtrees.append(Octree((xmid, ymid, zmid, xmax, ymax, zmax), self.capacidad))
-        
+    def indice_hijo(self, point):
+        """Índice del subcubo que contiene el punto (bit 0: x, bit 1: y, bit 2: z)."""
+        x, y, z = point
+        xmin, ymin, zmin, xmax, ymax, zmax = self.boundary
+        return ((x >= (xmin + xmax) / 2) |
+                (y >= (ymin + ymax) / 2) << 1 |
+                (z >= (zmin + zmax) / 2) << 2)
+
+    def hijo(self, i):
+        """Devuelve el subcubo ``i``; se crea recién cuando un punto lo necesita."""
+        if self.subtrees[i] is None:
+            xmin, ymin, zmin, xmax, ymax, zmax = self.boundary
+            xmid = (xmin + xmax) / 2
+            ymid = (ymin + ymax) / 2
+            zmid = (zmin + zmax) / 2
+            x0, x1 = (xmid, xmax) if i & 1 else (xmin, xmid)
+            y0, y1 = (ymid, ymax) if i & 2 else (ymin, ymid)
+            z0, z1 = (zmid, zmax) if i & 4 else (zmin, zmid)
+            self.subtrees[i] = Octree((x0, y0, z0, x1, y1, z1), self.capacidad, self.level + 1,
+                                      self.max_depth, self.min_node_size)
+        return self.subtrees[i]
+
+    def subdivide(self):
+        """Divide el cubo en ocho subcubos (que se crean a medida que se usan)."""
+        self.subtrees = [None] * 8
         self.divided = True
         for point in self.puntos:
-            for subtree in self.subtrees:
-                if subtree.contains(point):
-                    subtree.insert(point)
-                    break
+            self.hijo(self.indice_hijo(point)).insert(point)
 
         
         self.puntos = []
         
-    def imprimir_nodos_compacto(self, level=0):
+    def nodos_compactos(self, level=0):
         """
-        Imprime una descripción compacta de cada nodo en el octree y los puntos que contiene.
-        Muestra el nivel de profundidad, el número de puntos y sus coordenadas.
+        Genera una descripción compacta de cada nodo del octree y los puntos
+        que contiene: el nivel de profundidad, el número de puntos y sus
+        coordenadas.  Las líneas se producen a medida que se piden.
         """
-        indent = ' ' * (level * 4)  
+        indent = ' ' * (level * 4)
         xmin, ymin, zmin, xmax, ymax, zmax = self.boundary
-        
-        
-        print(f"{indent}Nivel {level}: {len(self.puntos)} puntos en ({xmin}, {ymin}, {zmin}) a ({xmax}, {ymax}, {zmax})")
-        
-        
+        yield (f"{indent}Nivel {level}: {len(self.puntos)} puntos en "
+               f"({xmin}, {ymin}, {zmin}) a ({xmax}, {ymax}, {zmax})")
         if self.puntos:
-            print(f"{indent}Puntos: {', '.join(map(str, self.puntos))}")
-        
-        
+            yield f"{indent}Puntos: {', '.join(map(str, self.puntos))}"
         if self.divided:
             for subtree in self.subtrees:
-                subtree.imprimir_nodos_compacto(level + 1)
-                
+                if subtree is not None:
+                    yield from subtree.nodos_compactos(level + 1)
+
+    def imprimir_nodos_compacto(self, level=0):
+        """Imprime ``nodos_compactos`` (solo cuando se pide, no al insertar)."""
+        for linea in self.nodos_compactos(level):
+            print(linea)
+
     def __str__(self):
         return f'Octree(boundary={self.boundary}, puntos={self.puntos}, divided={self.divided})'
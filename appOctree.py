@@ -1,6 +1,8 @@
 import random
 import threading
 from tkinter import Tk, Frame, Button, Canvas
+
+import numpy as np
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import TextNode, NodePath
 
@@ -10,29 +12,223 @@ class TreeNode:
         self.value = value
         self.left = None
         self.right = None
+        self.height = 1
+
+
+def _height(node):
+    return node.height if node is not None else 0
+
+
+def _fix_height(node):
+    node.height = 1 + max(_height(node.left), _height(node.right))
+
+
+def _rotate_right(node):
+    top = node.left
+    node.left = top.right
+    top.right = node
+    _fix_height(node)
+    _fix_height(top)
+    return top
+
+
+def _rotate_left(node):
+    top = node.right
+    node.right = top.left
+    top.left = node
+    _fix_height(node)
+    _fix_height(top)
+    return top
+
+
+def _rebalance(node):
+    """Corrige la altura de ``node`` y lo rota si quedo desbalanceado; devuelve la nueva raiz."""
+    _fix_height(node)
+    balance = _height(node.left) - _height(node.right)
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+    return node
 
 
 class BinarySearchTree:
+    """
+    Arbol binario de busqueda sin balancear: los valores menores van a la
+    izquierda y los demas (incluidos los repetidos) a la derecha.  Todo es
+    iterativo, asi que una entrada ordenada no llega al limite de recursion
+    (aunque el arbol queda con profundidad n).
+    """
+
     def __init__(self):
         self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _path(self, value):
+        """Nodos desde la raiz hasta donde iria ``value``."""
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            node = node.left if value < node.value else node.right
+        return path
 
     def insert(self, value):
-        if self.root is None:
-            self.root = TreeNode(value)
+        self._insert(value)
+
+    def _insert(self, value):
+        """Enlaza una hoja nueva con ``value``; devuelve el camino hasta su padre."""
+        path = self._path(value)
+        new = TreeNode(value)
+        if not path:
+            self.root = new
+        elif value < path[-1].value:
+            path[-1].left = new
         else:
-            self._insert_rec(self.root, value)
+            path[-1].right = new
+        self.size += 1
+        return path
+
+    def search(self, value):
+        """:return: True si ``value`` esta en el arbol"""
+        node = self.root
+        while node is not None:
+            if value == node.value:
+                return True
+            node = node.left if value < node.value else node.right
+        return False
+
+    def range(self, lo, hi):
+        """Valores ``v`` con ``lo <= v <= hi``, en orden."""
+        found = []
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            # se baja por la izquierda solo si ahi puede haber valores >= lo
+            while node is not None:
+                stack.append(node)
+                node = node.left if lo <= node.value else None
+            node = stack.pop()
+            if node.value > hi:
+                break
+            if node.value >= lo:
+                found.append(node.value)
+            node = node.right
+        return found
+
+    def __iter__(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.value
+            node = node.right
+
+
+class AVLTree(BinarySearchTree):
+    """
+    Arbol AVL: despues de cada insercion o borrado se recorre de vuelta el
+    camino desde la raiz corrigiendo alturas y rotando donde las ramas
+    difieren en mas de uno, asi la altura queda en O(log n).
+    ``from_sorted`` e ``insert_many`` arman el arbol balanceado de una vez.
+    """
 
-    def _insert_rec(self, node, value):
-        if value < node.value:
-            if node.left is None:
-                node.left = TreeNode(value)
-            else:
-                self._insert_rec(node.left, value)
+    def insert(self, value):
+        self._rebalance_path(self._insert(value))
+
+    def delete(self, value):
+        """
+        Borra una aparicion de ``value``.
+        :return: False si no estaba
+        """
+        path = []
+        node = self.root
+        while node is not None and value != node.value:
+            path.append(node)
+            node = node.left if value < node.value else node.right
+        if node is None:
+            return False
+        if node.left is not None and node.right is not None:
+            # se reemplaza por el sucesor y se borra el sucesor
+            path.append(node)
+            succ = node.right
+            while succ.left is not None:
+                path.append(succ)
+                succ = succ.left
+            node.value = succ.value
+            node = succ
+        child = node.left if node.left is not None else node.right
+        self._replace(path[-1] if path else None, node, child)
+        self.size -= 1
+        self._rebalance_path(path)
+        return True
+
+    def _replace(self, parent, old, new):
+        if parent is None:
+            self.root = new
+        elif parent.left is old:
+            parent.left = new
         else:
-            if node.right is None:
-                node.right = TreeNode(value)
+            parent.right = new
+
+    def _rebalance_path(self, path):
+        """Rebalancea los nodos de ``path`` de abajo hacia arriba."""
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            top = _rebalance(node)
+            if top is not node:
+                self._replace(path[i - 1] if i else None, node, top)
+
+    @classmethod
+    def from_sorted(cls, values):
+        """Arbol perfectamente balanceado a partir de valores ya ordenados."""
+        tree = cls()
+        tree._build(list(values))
+        return tree
+
+    def insert_many(self, values):
+        """
+        Inserta muchos valores juntos: se ordenan con NumPy, se mezclan con
+        los que ya estaban y se arma el arbol de nuevo, O(n + m log m).
+        """
+        new = np.sort(np.asarray(values).reshape(-1))
+        if not len(new):
+            return
+        if self.root is not None:
+            # NumPy elige un tipo comun para los viejos y los nuevos
+            new = np.sort(np.concatenate([np.array(list(self)), new]), kind="stable")
+        self._build(new.tolist())
+
+    def _build(self, values):
+        self.size = len(values)
+        self.root = None
+        # (inicio, fin, padre, lado): el valor del medio es la raiz del rango
+        stack = [(0, len(values), None, None)]
+        while stack:
+            lo, hi, parent, left = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            node = TreeNode(values[mid])
+            node.height = (hi - lo).bit_length()
+            if parent is None:
+                self.root = node
+            elif left:
+                parent.left = node
             else:
-                self._insert_rec(node.right, value)
+                parent.right = node
+            stack.append((lo, mid, node, True))
+            stack.append((mid + 1, hi, node, False))
 
 
 def draw_tree(canvas, node, x, y, dx, scale_factor, buttons):
@@ -108,7 +304,7 @@ class MyApp(ShowBase):
 
 
 def create_tkinter_window(panda_app):
-    bst = BinarySearchTree()
+    bst = AVLTree()
     scale_factor = 1.0  
     buttons = []  
 
@@ -138,7 +334,7 @@ def create_tkinter_window(panda_app):
 
     root = Tk()
     root.geometry("1600x400")
-    root.title("Binary Search Tree with Zoom")
+    root.title("AVL Tree with Zoom")
 
     frame = Frame(root)
     frame.pack(fill='both', expand=True)
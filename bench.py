@@ -0,0 +1,338 @@
+"""
+Benchmark sin interfaz grafica de las implementaciones de octree.
+
+Mide construccion, insercion punto a punto, busqueda, kNN, consulta por caja,
+borrado y memoria por punto sobre datos sinteticos (uniformes, nubes
+gaussianas y con muchos duplicados) de varios tamanos y capacidades, y
+escribe los resultados en JSON.  Cada operacion se mide ``--repeats`` veces
+y se guarda la mejor pasada (y la mediana), medida contra un trabajo fijo de
+referencia que sigue los cambios de velocidad de la maquina: una sola
+pasada tiene demasiado ruido para comparar.  Con ``--baseline`` compara
+contra una corrida anterior y marca las operaciones que empeoraron mas de
+``--threshold`` y ademas mas de ``--min-delta`` segundos por operacion.
+
+    python bench.py --sizes 1e3 1e4 1e5 --out bench.json
+    python bench.py --sizes 1e3 1e4 1e5 --baseline bench.json
+
+Backends: "core" (``octree_core.Octree``, el de ``test.py``), "morton"
+(``octree_morton.MortonOctree``) y "algo" (``algo_octree.Octree``, necesita
+Panda3D instalado porque el modulo lo importa).  El octree de C# de
+UNITY_OCTREE corre dentro de Unity y no se puede medir desde aca.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+SIZE = 10.0
+DATASETS = ("uniform", "clustered", "duplicates")
+OPS = ("build", "insert", "search", "knn", "box", "delete")
+
+
+# ----------------------------------------------------------------------
+# datos
+# ----------------------------------------------------------------------
+def make_points(kind, n, seed=0):
+    """Puntos (n, 3) dentro del cubo ``[-SIZE/2, SIZE/2]``."""
+    rng = np.random.default_rng(seed)
+    half = SIZE / 2
+    if kind == "uniform":
+        pts = rng.uniform(-half, half, (n, 3))
+    elif kind == "clustered":
+        centers = rng.uniform(-half * 0.8, half * 0.8, (16, 3))
+        pts = centers[rng.integers(0, len(centers), n)] + rng.normal(0, SIZE / 100, (n, 3))
+    elif kind == "duplicates":
+        # 1 de cada 20 puntos es distinto; el resto repite alguno de ellos
+        unique = rng.uniform(-half, half, (max(n // 20, 1), 3))
+        pts = unique[rng.integers(0, len(unique), n)]
+    else:
+        raise ValueError(f"dataset desconocido: {kind!r}")
+    return np.clip(pts, -half, half)
+
+
+# ----------------------------------------------------------------------
+# backends
+# ----------------------------------------------------------------------
+class CoreBackend:
+    name = "core"
+    max_points = 10**7
+    ops = OPS
+
+    def __init__(self, capacity):
+        from octree_core import Octree
+        self.Octree = Octree
+        self.capacity = capacity
+
+    def empty(self):
+        h = SIZE / 2
+        return self.Octree(-h, -h, -h, h, h, h, self.capacity)
+
+    def build(self, pts):
+        h = SIZE / 2
+        return self.Octree.from_points(pts, self.capacity, bounds=((-h,) * 3, (h,) * 3))
+
+    def insert(self, tree, p):
+        tree.insert(*p)
+
+    def search(self, tree, p):
+        return tree.search(*p)
+
+    def knn(self, tree, p, k):
+        return tree.knn(p, k)
+
+    def box(self, tree, lo, hi):
+        return tree.query_box(lo, hi)
+
+    def delete(self, tree, p):
+        return tree.delete(*p)
+
+
+class MortonBackend(CoreBackend):
+    name = "morton"
+    ops = ("build", "insert", "search", "box")
+
+    def __init__(self, capacity):
+        from octree_morton import MortonOctree
+        self.Octree = MortonOctree
+        self.capacity = capacity
+
+
+class AlgoBackend:
+    """``algo_octree.Octree``: objetos por nodo, solo inserta."""
+    name = "algo"
+    max_points = 10**5
+    ops = ("build", "insert")
+
+    def __init__(self, capacity):
+        from algo_octree import Octree
+        self.Octree = Octree
+        self.capacity = capacity
+
+    def empty(self):
+        h = SIZE / 2
+        # ``contains`` es semiabierto: se agranda un poco el borde superior
+        return self.Octree((-h, -h, -h, h * 1.001, h * 1.001, h * 1.001), self.capacity)
+
+    def build(self, pts):
+        tree = self.empty()
+        for p in pts.tolist():
+            tree.insert(tuple(p))
+        return tree
+
+    def insert(self, tree, p):
+        tree.insert(tuple(p))
+
+
+BACKENDS = {b.name: b for b in (CoreBackend, MortonBackend, AlgoBackend)}
+
+
+# ----------------------------------------------------------------------
+# mediciones
+# ----------------------------------------------------------------------
+def _timed(fn, items, repeats=1, setup=None):
+    """
+    ``repeats`` pasadas de ``fn`` sobre ``items``, cada una junto con
+    ``_reference()`` medido justo antes.  Ordenadas por tiempo relativo a la
+    referencia: la velocidad de la maquina cambia entre una pasada y otra.
+    :param setup: se llama antes de cada pasada, fuera de la medicion; lo
+        que devuelve se pasa a ``fn`` como primer argumento
+    :return: lista de (segundos, referencia)
+    """
+    times = []
+    for _ in range(repeats):
+        state = setup() if setup is not None else None
+        reference = _reference()
+        start = time.perf_counter()
+        if setup is None:
+            for item in items:
+                fn(*item)
+        else:
+            for item in items:
+                fn(state, *item)
+        times.append((time.perf_counter() - start, reference))
+    return sorted(times, key=lambda t: t[0] / t[1])
+
+
+def _reference(repeats=3):
+    """
+    Mejor tiempo de un trabajo fijo (Python y NumPy chico, como las
+    operaciones medidas) que no depende de ningun octree: mide que tan
+    rapida esta la maquina en ese momento.
+    """
+    a = np.arange(8.0)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        total = 0.0
+        for i in range(200):
+            total += float(np.minimum(a, i % 7).sum()) + len(str(i))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_case(backend, dataset, n, queries=1000, k=8, seed=0, repeats=5):
+    """
+    Mide todas las operaciones de ``backend`` para un caso; devuelve registros.
+    :param repeats: pasadas por operacion; ``per_op`` es la mejor y
+        ``median`` la mediana, ambas en segundos por operacion y relativas a
+        ``reference``, el ``_reference()`` de la mejor pasada
+    """
+    pts = make_points(dataset, n, seed)
+    rng = np.random.default_rng(seed + 1)
+    sample = pts[rng.integers(0, n, queries)]
+    misses = make_points("uniform", queries, seed + 2)
+    base = {"backend": backend.name, "dataset": dataset, "n": n,
+            "capacity": backend.capacity}
+    records = []
+
+    def record(op, times, count):
+        count = max(count, 1)
+        (seconds, reference), (median, median_reference) = times[0], times[len(times) // 2]
+        # la mediana se lleva a la velocidad de la mejor pasada
+        records.append(dict(base, op=op, seconds=seconds, count=count,
+                            per_op=seconds / count,
+                            median=median * reference / median_reference / count,
+                            repeats=len(times), reference=reference))
+
+    record("build", _timed(backend.build, [(pts,)], repeats), n)
+    tree = backend.build(pts)
+
+    if "insert" in backend.ops:
+        record("insert", _timed(backend.insert, [(p,) for p in pts[:queries]], repeats,
+                                setup=backend.empty), min(queries, n))
+    if "search" in backend.ops:
+        both = np.concatenate([sample, misses])
+        record("search", _timed(lambda p: backend.search(tree, p), [(p,) for p in both],
+                                repeats), len(both))
+    if "knn" in backend.ops:
+        record("knn", _timed(lambda p: backend.knn(tree, p, k), [(p,) for p in sample],
+                             repeats), queries)
+    if "box" in backend.ops:
+        side = SIZE / 20
+        boxes = [(c - side, c + side) for c in sample]
+        record("box", _timed(lambda lo, hi: backend.box(tree, lo, hi), boxes, repeats), queries)
+    if "delete" in backend.ops:
+        # borrar cambia el arbol: cada pasada sobre uno recien armado
+        record("delete", _timed(backend.delete, [(p,) for p in sample], repeats,
+                                setup=lambda: backend.build(pts)), queries)
+    del tree
+
+    # memoria en una construccion aparte: tracemalloc hace mas lento el resto
+    tracemalloc.start()
+    tree = backend.build(pts)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+    records.append(dict(base, op="memory", bytes=used, per_point=used / n))
+    return records
+
+
+def run(backends, datasets, sizes, capacities, queries=1000, seed=0, repeats=5,
+        log=sys.stderr):
+    results = []
+    for name in backends:
+        for capacity in capacities:
+            try:
+                backend = BACKENDS[name](capacity)
+            except ImportError as e:
+                print(f"{name}: se omite ({e})", file=log)
+                break
+            for dataset in datasets:
+                for n in sizes:
+                    if n > backend.max_points:
+                        continue
+                    print(f"{name} {dataset} n={n} capacity={capacity}", file=log)
+                    results += run_case(backend, dataset, n, queries, seed=seed,
+                                        repeats=repeats)
+    return results
+
+
+def compare(results, baseline, threshold=0.2, min_delta=5e-6):
+    """
+    Registros de ``results`` que empeoraron mas de ``threshold`` (0.2 = 20%)
+    respecto al registro equivalente de ``baseline``.  En los tiempos se
+    compara la mejor pasada nueva contra la mediana de la base: la
+    variacion entre pasadas de la base no cuenta como regresion.  Si los
+    dos registros tienen ``reference`` el valor de la base se escala por la
+    velocidad de la maquina en cada corrida.
+    :param min_delta: en los tiempos, diferencia minima en segundos por
+        operacion para marcar una regresion (piso de ruido); la memoria no
+        tiene ruido y se compara solo con ``threshold``
+    :return: lista de (registro, valor de la base, proporcion)
+    """
+    def key(r):
+        return r["backend"], r["dataset"], r["n"], r["capacity"], r["op"]
+
+    def value(r, typical=False):
+        if r["op"] == "memory":
+            return r["per_point"]
+        # las bases viejas no tienen ``median``
+        return r.get("median", r["per_op"]) if typical else r["per_op"]
+
+    old = {key(r): r for r in baseline}
+    worse = []
+    for r in results:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        before = value(b, typical=True)
+        if "reference" in r and "reference" in b:
+            before *= r["reference"] / b["reference"]
+        floor = 0 if r["op"] == "memory" else min_delta
+        if before and value(r) > before * (1 + threshold) and value(r) - before > floor:
+            worse.append((r, before, value(r) / before))
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["core", "morton"],
+                        choices=sorted(BACKENDS))
+    parser.add_argument("--datasets", nargs="+", default=list(DATASETS), choices=DATASETS)
+    parser.add_argument("--sizes", nargs="+", type=float, default=[1e3, 1e4, 1e5])
+    parser.add_argument("--capacities", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--baseline", help="resultados anteriores para comparar")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="pasadas por operacion (se guarda la mejor)")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-delta", type=float, default=5e-6,
+                        help="segundos por operacion que debe empeorar un tiempo "
+                             "para marcarlo")
+    args = parser.parse_args(argv)
+
+    results = run(args.backends, args.datasets, [int(n) for n in args.sizes],
+                  args.capacities, args.queries, args.seed, args.repeats)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=1)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        worse = compare(results, baseline, args.threshold, args.min_delta)
+        for r, before, ratio in worse:
+            print(f"REGRESION {r['backend']} {r['dataset']} n={r['n']} "
+                  f"capacity={r['capacity']} {r['op']}: x{ratio:.2f} (antes {before:.3g})",
+                  file=sys.stderr)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
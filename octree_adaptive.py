@@ -0,0 +1,241 @@
+"""
+Capacidad adaptativa y reconstruccion automatica de subarboles para
+``octree_core.Octree``.
+
+``Tuner`` mira las estadisticas del arbol (``tree.enable_stats()``) entre
+una llamada a ``step`` y la siguiente:
+
+- Capacidad: una consulta paga por nodo visitado (Python, un nodo a la vez)
+  y por punto probado (NumPy, barato).  Si se prueban pocos puntos por nodo
+  visitado conviene hojas mas grandes y viceversa; el objetivo es
+  ``node_cost`` puntos probados por nodo.  Las inserciones siempre prefieren
+  hojas mas grandes (menos divisiones).  Las dos sugerencias se mezclan
+  segun el tiempo que se fue en consultas y en inserciones.
+- Reconstruccion: recien armado, un subarbol de ``count`` puntos tiene a lo
+  sumo unas ``count / (capacity / 8)`` hojas (una por punto con capacidad
+  8 o menos).  Si tiene ``fragmentation`` veces mas, si la mayoria de sus
+  puntos quedaron en hojas pasadas de capacidad (se bajo la capacidad) o en
+  nodos divididos que ya no llegan a ``capacity`` (se subio), o si es
+  ``depth_slack`` niveles mas profundo de lo necesario, se reconstruye con
+  ``Octree.rebuild``.
+
+``start()`` corre ``step`` en un hilo cada ``interval`` segundos.  Con un
+``octree_concurrent.SnapshotOctree`` como ``writer`` los cambios se hacen
+dentro de ``writer.write()``: los lectores siguen con la foto anterior
+hasta que termina la reconstruccion.  Sin ``writer`` nadie mas debe tocar el
+arbol mientras corre ``step``.
+"""
+import math
+import threading
+
+import numpy as np
+
+from octree_log import get_logger
+
+log = get_logger("adaptive")
+
+QUERY_OPS = ("find", "knn", "query_radius", "query_box", "query_frustum", "raycast")
+INSERT_OPS = ("insert", "insert_many")
+
+
+def subtree_shape(tree):
+    """
+    Por nodo: cantidad de hojas y profundidad de la hoja mas honda de su
+    subarbol (0 y -1 en filas libres).
+    """
+    n = tree.n_nodes
+    depth = tree.depth[:n]
+    live = depth != -1
+    leaf = live & ~tree.divided[:n]
+    leaves = leaf.astype(np.int64)
+    deepest = np.where(leaf, depth, -1).astype(np.int64)
+    for d in range(int(depth.max()), 0, -1):
+        level = np.flatnonzero(depth == d)
+        up = tree.parent[level]
+        leaves += np.bincount(up, leaves[level], minlength=n).astype(np.int64)
+        np.maximum.at(deepest, up, deepest[level])
+    return leaves, deepest
+
+
+class Tuner:
+    """
+    Ajusta ``tree.capacity`` y reconstruye los subarboles degradados.
+
+    :param writer: ``SnapshotOctree`` del arbol, si hay lectores concurrentes
+    :param node_cost: puntos probados que "valen" lo mismo que un nodo visitado
+    :param fragmentation: relacion hojas reales / hojas esperadas que dispara
+        una reconstruccion; tambien se reconstruye si mas de la mitad de los
+        puntos quedaron en hojas pasadas de capacidad (al bajarla) o en nodos
+        divididos con ``capacity`` puntos o menos (al subirla)
+    :param depth_slack: niveles de mas tolerados sobre la profundidad necesaria
+    :param min_points: subarboles mas chicos no se reconstruyen
+    :param min_ops: operaciones necesarias entre pasos para cambiar la capacidad
+    :param budget: puntos reubicados como maximo por paso (al menos un subarbol)
+    """
+
+    def __init__(self, tree, writer=None, min_capacity=1, max_capacity=64, node_cost=8.0,
+                 fragmentation=2.0, depth_slack=4, min_points=64, min_ops=100,
+                 budget=1_000_000):
+        self.tree = tree
+        self.writer = writer
+        self.min_capacity = min_capacity
+        self.max_capacity = max_capacity
+        self.node_cost = node_cost
+        self.fragmentation = fragmentation
+        self.depth_slack = depth_slack
+        self.min_points = min_points
+        self.min_ops = min_ops
+        self.budget = budget
+        self.stats = tree.enable_stats()
+        if writer is not None:
+            # la foto vigente todavia no tiene ``stats``: sin esto las
+            # consultas de los lectores no se cuentan hasta la proxima escritura
+            writer.publish()
+        self._last = self._totals()
+        # nodo -> (capacidad, puntos) de su ultima reconstruccion
+        self._rebuilt = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _totals(self):
+        ops = self.stats.ops
+        query = [ops[op] for op in QUERY_OPS if op in ops]
+        insert = [ops[op] for op in INSERT_OPS if op in ops]
+        return {
+            "queries": sum(s.calls for s in query),
+            "visited": sum(s.nodes_visited for s in query),
+            "tested": sum(s.points_tested for s in query),
+            "query_seconds": sum(s.seconds for s in query),
+            "insert_seconds": sum(s.seconds for s in insert),
+            "inserted": self.stats.events["points_inserted"],
+        }
+
+    def suggest_capacity(self, delta):
+        """
+        Capacidad sugerida a partir de los contadores ``delta`` acumulados
+        desde el paso anterior.
+        """
+        cap = self.tree.capacity
+        if delta["queries"] + delta["inserted"] < self.min_ops:
+            return cap
+        busy = delta["query_seconds"] + delta["insert_seconds"]
+        if busy <= 0:
+            return cap
+        weight = delta["query_seconds"] / busy
+        if delta["visited"]:
+            ratio = max(delta["tested"] / delta["visited"], 1 / 8)
+            for_queries = cap * self.node_cost / ratio
+        else:
+            for_queries = cap
+        for_inserts = cap * 2
+        target = math.exp(weight * math.log(for_queries) +
+                          (1 - weight) * math.log(for_inserts))
+        target = min(max(target, cap / 4, self.min_capacity), cap * 4, self.max_capacity)
+        # con cambios chicos no vale la pena reconstruir
+        if 2 / 3 < target / cap < 3 / 2:
+            return cap
+        return int(round(target))
+
+    def degraded(self):
+        """Nodos mas altos cuyo subarbol conviene reconstruir, de mayor a menor."""
+        tree = self.tree
+        n = tree.n_nodes
+        leaves, deepest = subtree_shape(tree)
+        count = tree.count[:n].astype(np.int64)
+        depth = tree.depth[:n].astype(np.int64)
+        # al dividir una hoja llena quedan unos ``capacity / 8`` puntos por
+        # hoja (y nunca menos de uno): con menos que eso en promedio el
+        # subarbol esta fragmentado.  Con capacidad chica una hoja por punto
+        # es lo esperado; lo que se ve ahi es ``under``
+        need = np.maximum(1, count / max(tree.capacity / 8, 1))
+        need_depth = np.ceil(np.log(np.maximum(1, count / tree.capacity)) / np.log(8))
+        # puntos en hojas pasadas de capacidad que se podrian dividir (las
+        # hojas balde no cuentan: reconstruir no las cambia)
+        full = (~tree.divided[:n] & (depth != -1) & (count > tree.capacity) &
+                tree.can_split_many(np.arange(n)))
+        over = np.where(full, count, 0)
+        # puntos bajo nodos divididos que con la capacidad actual serian
+        # hojas (se cuenta solo el mas alto de cada rama)
+        small = tree.divided[:n] & (depth != -1) & (count <= tree.capacity)
+        parent = tree.parent[:n]
+        small[1:] &= ~small[np.maximum(parent[1:], 0)]
+        under = np.where(small, count, 0)
+        for d in range(int(depth.max()), 0, -1):
+            level = np.flatnonzero(depth == d)
+            up = tree.parent[level]
+            over += np.bincount(up, over[level], minlength=n).astype(np.int64)
+            under += np.bincount(up, under[level], minlength=n).astype(np.int64)
+        bad = ((leaves > self.fragmentation * need) |
+               (over * 2 > count) |
+               (under * 2 > count) |
+               ((deepest - depth > need_depth + self.depth_slack) & (leaves > need)))
+        bad &= (depth != -1) & (count >= self.min_points)
+        for node in np.flatnonzero(bad):
+            capacity, points = self._rebuilt.get(int(node), (None, 0))
+            # el mismo subarbol con la misma capacidad quedaria igual
+            if capacity == tree.capacity and abs(count[node] - points) * 4 < points:
+                bad[node] = False
+
+        # solo los mas altos: los de abajo se reconstruyen con ellos
+        covered = np.zeros(n, bool)
+        top = np.zeros(n, bool)
+        for d in range(int(depth.max()) + 1):
+            level = np.flatnonzero(depth == d)
+            if d:
+                covered[level] = covered[tree.parent[level]]
+            first = level[bad[level] & ~covered[level]]
+            covered[first] = True
+            top[first] = True
+        top = np.flatnonzero(top)
+        return top[np.argsort(-count[top], kind="stable")]
+
+    def step(self):
+        """
+        Ajusta la capacidad y reconstruye lo que haga falta.
+        :return: dict con la capacidad anterior y la nueva, nodos reconstruidos
+            y puntos reubicados
+        """
+        if self.writer is None:
+            return self._apply(self.tree)
+        with self.writer.write() as tree:
+            return self._apply(tree)
+
+    def _apply(self, tree):
+        totals = self._totals()
+        delta = {k: totals[k] - self._last[k] for k in totals}
+        self._last = totals
+        old = tree.capacity
+        tree.capacity = self.suggest_capacity(delta)
+        if tree.capacity != old:
+            log.info("capacidad %d -> %d", old, tree.capacity)
+            self._rebuilt.clear()
+        rebuilt = []
+        moved = 0
+        for node in self.degraded():
+            if rebuilt and moved + tree.count[node] > self.budget:
+                break
+            moved += tree.rebuild(int(node))
+            self._rebuilt[int(node)] = (tree.capacity, int(tree.count[node]))
+            rebuilt.append(int(node))
+        if rebuilt:
+            log.info("reconstruidos %d subarboles, %d puntos", len(rebuilt), moved)
+        return {"capacity": (old, tree.capacity), "rebuilt": rebuilt, "moved": moved}
+
+    def start(self, interval=1.0):
+        """Corre ``step`` en un hilo cada ``interval`` segundos."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.step()
+
+        self._thread = threading.Thread(target=loop, name="octree-tuner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,405 @@
+"""
+Construccion de ``octree_core.Octree`` para conjuntos de puntos que no
+entran en memoria.
+
+``stream_build`` recibe los puntos por bloques (de un CSV, un ``.npy`` o un
+archivo binario crudo, ver ``iter_csv`` / ``iter_npy`` / ``iter_raw``), los
+reparte por octantes en archivos temporales hasta que cada particion entra
+en el presupuesto de memoria, construye cada subarbol por separado con
+``Octree.from_points`` y arma el archivo final en el formato de
+``Octree.save``.  El arbol resultante es el mismo que se obtendria con
+``insert_many`` de todos los puntos: las particiones se cortan en los mismos
+planos medios y con la misma regla ``x > mid`` de ``get_child_index``.
+
+``parallel_build`` usa el mismo reparto para construir en paralelo: divide
+los puntos en los octantes de los primeros niveles, construye cada subarbol
+en un ``ProcessPoolExecutor`` leyendo los puntos de memoria compartida y
+cose los resultados bajo una misma raiz.
+"""
+import itertools
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from octree_core import _OCTANT, _UPPER, Octree, file_header
+
+# bytes aproximados por punto de un ``from_points`` en memoria (coordenadas,
+# listas de hojas, nodos y temporales de ``insert_many``)
+BUILD_BYTES = 256
+
+
+def iter_npy(path, chunk=1_000_000):
+    """Bloques (n, 3) de un ``.npy`` de forma (N, 3), sin cargarlo entero."""
+    data = np.load(path, mmap_mode="r")
+    for start in range(0, len(data), chunk):
+        yield np.asarray(data[start:start + chunk])
+
+
+def iter_raw(path, dtype=np.float32, chunk=1_000_000):
+    """Bloques (n, 3) de un archivo binario de ternas x, y, z seguidas."""
+    with open(path, "rb") as f:
+        while True:
+            block = np.fromfile(f, dtype, 3 * chunk)
+            if not len(block):
+                return
+            yield block[:len(block) // 3 * 3].reshape(-1, 3)
+
+
+def iter_csv(path, chunk=1_000_000, delimiter=",", skip_header=0, columns=(0, 1, 2)):
+    """Bloques (n, 3) de un CSV con x, y, z en las columnas ``columns``."""
+    with open(path) as f:
+        for _ in range(skip_header):
+            next(f)
+        while True:
+            lines = list(itertools.islice(f, chunk))
+            if not lines:
+                return
+            yield np.loadtxt(lines, delimiter=delimiter, usecols=columns, ndmin=2)
+
+
+class _Partition:
+    """
+    Puntos de un nodo: guardados en el archivo temporal ``path`` o, en
+    ``parallel_build``, como indices ``ids`` del arreglo de entrada.
+    """
+
+    def __init__(self, path, lo, hi, depth, ids=None):
+        self.path = path
+        self.lo = lo
+        self.hi = hi
+        self.depth = depth
+        self.ids = ids
+        self.count = 0 if ids is None else len(ids)
+
+    def blocks(self, dtype, size):
+        with open(self.path, "rb") as f:
+            while True:
+                block = np.fromfile(f, dtype, 3 * size)
+                if not len(block):
+                    return
+                yield block.reshape(-1, 3)
+
+
+def stream_build(chunks, path, bounds=None, capacity=1, dtype=np.float64, max_depth=32,
+                 min_node_size=0.0, memory=256 * 2**20, tmpdir=None):
+    """
+    Construye un octree a partir de bloques de puntos sin tenerlos todos en
+    memoria y lo escribe en ``path`` con el formato de ``Octree.save``.
+
+    Una particion con mas puntos de los que entran en ``memory`` se reparte
+    en los archivos de sus ocho octantes (el nodo queda dividido, igual que
+    en ``insert_many``); una que entra se construye con ``from_points`` y sus
+    filas se agregan a archivos temporales por campo.  Al final se escribe
+    la cabecera y se copian los campos en bloques.  Una particion que ya no
+    se puede dividir (``max_depth`` / ``min_node_size``) se construye entera
+    aunque pase del presupuesto.
+
+    :param chunks: iterable de arreglos (n, 3)
+    :param bounds: (min, max) de la raiz; si es None se calcula con una
+        pasada extra sobre los puntos
+    :param memory: presupuesto aproximado en bytes
+    :param tmpdir: carpeta para los archivos temporales
+    :return: el arbol abierto con ``Octree.open(path)``
+    """
+    dtype = np.dtype(dtype)
+    block = max(memory // (4 * 3 * dtype.itemsize), 1)
+    fits = max(memory // BUILD_BYTES, capacity + 1)
+    work = tempfile.mkdtemp(prefix="octree-", dir=tmpdir)
+    try:
+        root = _spill(chunks, work, bounds, dtype)
+        top, subtrees = _partition(root, lambda part: _split(part, dtype, block),
+                                   lambda part: part.count <= fits, max_depth, min_node_size)
+        _assemble(path, top, subtrees, work, dtype, capacity, max_depth, min_node_size)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return Octree.open(path)
+
+
+def _spill(chunks, work, bounds, dtype):
+    """Copia los puntos a la particion raiz, descartando los de fuera de ``bounds``."""
+    lo = hi = None
+    if bounds is not None:
+        lo, hi = (np.asarray(b, dtype) for b in bounds)
+    root = _Partition(os.path.join(work, "root"), lo, hi, 0)
+    with open(root.path, "wb") as f:
+        for pts in chunks:
+            pts = np.asarray(pts, dtype).reshape(-1, 3)
+            if bounds is None:
+                if len(pts):
+                    cmin, cmax = pts.min(axis=0), pts.max(axis=0)
+                    root.lo = cmin if root.lo is None else np.minimum(root.lo, cmin)
+                    root.hi = cmax if root.hi is None else np.maximum(root.hi, cmax)
+            else:
+                pts = pts[np.all((pts >= lo) & (pts <= hi), axis=1)]
+            pts.tofile(f)
+            root.count += len(pts)
+    if root.lo is None:
+        root.lo = root.hi = np.zeros(3, dtype)
+    return root
+
+
+def _partition(root, split, small, max_depth, min_node_size):
+    """
+    Reparte con ``split(part)`` (que devuelve ``{octante: hijo}``) las
+    particiones que no cumplen ``small(part)`` y que todavia se pueden dividir.
+    :return: (top, subtrees): ``top`` son los nodos divididos en disco como
+        dicts (lo, hi, depth, parent, children), con hijos ``("top", i)`` o
+        ``("sub", j)``; ``subtrees`` pares (particion, padre) que se
+        construyen con ``from_points``
+    """
+    top = []
+    subtrees = []
+
+    def can_split(part):
+        size = (part.hi - part.lo).max()
+        return part.depth < max_depth and size > min_node_size
+
+    def add(part, parent):
+        if small(part) or not can_split(part):
+            subtrees.append((part, parent))
+            return ("sub", len(subtrees) - 1)
+        node = {"lo": part.lo, "hi": part.hi, "depth": part.depth, "parent": parent,
+                "children": [None] * 8}
+        top.append(node)
+        index = len(top) - 1
+        for octant, child in split(part).items():
+            node["children"][octant] = add(child, index)
+        return ("top", index)
+
+    add(root, -1)
+    return top, subtrees
+
+
+def _split(part, dtype, block):
+    """Reparte el archivo de ``part`` en los de sus octantes no vacios."""
+    children = {}
+    files = {}
+    try:
+        for pts in part.blocks(dtype, block):
+            octant, mid = _octants(pts, part.lo, part.hi)
+            for o in np.flatnonzero(np.bincount(octant, minlength=8)):
+                if o not in files:
+                    upper = _UPPER[o]
+                    child = _Partition(f"{part.path}.{o}", np.where(upper, mid, part.lo),
+                                       np.where(upper, part.hi, mid), part.depth + 1)
+                    children[int(o)] = child
+                    files[o] = open(child.path, "wb")
+                sel = pts[octant == o]
+                sel.tofile(files[o])
+                children[int(o)].count += len(sel)
+    finally:
+        for f in files.values():
+            f.close()
+    os.remove(part.path)
+    return children
+
+
+def _octants(xyz, lo, hi):
+    """Octante de cada punto segun ``get_child_indices`` y el punto medio."""
+    mid = lo + hi
+    mid *= 0.5
+    gt = (xyz > mid).view(np.uint8)
+    return _OCTANT[gt[:, 0] | gt[:, 1] << 1 | gt[:, 2] << 2], mid
+
+
+def _assemble(path, top, subtrees, work, dtype, capacity, max_depth, min_node_size):
+    """
+    Construye cada subarbol, agrega sus filas a un archivo por campo y
+    escribe el archivo final: primero las filas de ``top`` y despues las de
+    los subarboles en orden.
+    """
+    spec = Octree(0, 0, 0, 1, 1, 1, dtype=dtype)
+    node_fields = spec._node_fields()
+    point_fields = spec._point_fields()
+    spill = {name: open(os.path.join(work, "field-" + name), "wb")
+             for name, *_ in node_fields + point_fields}
+    n_nodes = len(top)
+    n_points = 0
+    roots = []
+    try:
+        for part, parent in subtrees:
+            pts = np.fromfile(part.path, dtype).reshape(-1, 3)
+            os.remove(part.path)
+            tree = Octree.from_points(pts, capacity, bounds=(part.lo, part.hi), dtype=dtype,
+                                      max_depth=max_depth - part.depth,
+                                      min_node_size=min_node_size)
+            del pts
+            _shift(tree, n_nodes, np.arange(n_points, n_points + tree.n_points),
+                   part.depth, parent)
+            for name, *_ in node_fields:
+                getattr(tree, name)[:tree.n_nodes].tofile(spill[name])
+            for name, *_ in point_fields:
+                getattr(tree, name)[:tree.n_points].tofile(spill[name])
+            roots.append((n_nodes, tree.count[0], tree.total[0].copy(),
+                          tree.box_min[0].copy(), tree.box_max[0].copy()))
+            n_nodes += tree.n_nodes
+            n_points += tree.n_points
+    finally:
+        for f in spill.values():
+            f.close()
+
+    rows = _top_rows(top, roots, dtype)
+    meta = dict(spec.file_meta(), capacity=capacity, max_depth=max_depth,
+                min_node_size=min_node_size, n_nodes=n_nodes, n_points=n_points)
+    arrays = [(name, dt, (n_nodes,) + shape) for name, shape, dt, _ in node_fields]
+    arrays += [(name, dt, (n_points,) + shape) for name, shape, dt, _ in point_fields]
+    arrays += [("free_nodes", np.int64, (0,)), ("free_points", np.int64, (0,))]
+    header, start, meta = file_header(meta, arrays)
+    node_names = {name for name, *_ in node_fields}
+    with open(path, "wb") as f:
+        f.write(header)
+        for name, *_ in node_fields + point_fields:
+            f.seek(start + meta["arrays"][name][2])
+            if name in node_names:
+                getattr(rows, name)[:len(top)].tofile(f)
+            with open(os.path.join(work, "field-" + name), "rb") as src:
+                shutil.copyfileobj(src, f, 16 * 2**20)
+
+
+def _top_rows(top, roots, dtype):
+    """
+    Filas de los nodos de ``top`` (divididos antes de construir los
+    subarboles), con los agregados sumados desde sus hijos.
+    :param roots: (id, count, total, box_min, box_max) de la raiz de cada subarbol
+    """
+    rows = Octree(0, 0, 0, 1, 1, 1, dtype=dtype)
+    rows._alloc_nodes(max(len(top), 1))
+    for i, node in enumerate(top):
+        rows.node_min[i] = node["lo"]
+        rows.node_max[i] = node["hi"]
+        rows.depth[i] = node["depth"]
+        rows.parent[i] = node["parent"]
+        rows.divided[i] = True
+        for octant, child in enumerate(node["children"]):
+            if child is not None:
+                kind, j = child
+                rows.children[i, octant] = j if kind == "top" else roots[j][0]
+    # los hijos de ``top`` siempre tienen indice mayor que su padre
+    for i in range(len(top) - 1, -1, -1):
+        for kind, j in filter(None, top[i]["children"]):
+            if kind == "top":
+                count, total, lo, hi = (rows.count[j], rows.total[j],
+                                        rows.box_min[j], rows.box_max[j])
+            else:
+                _, count, total, lo, hi = roots[j]
+            rows.count[i] += count
+            rows.total[i] += total
+            rows.box_min[i] = np.minimum(rows.box_min[i], lo)
+            rows.box_max[i] = np.maximum(rows.box_max[i], hi)
+    return rows
+
+
+def _shift(tree, node_base, point_map, depth, parent):
+    """
+    Renumera un subarbol construido aparte para ubicarlo en el arbol final:
+    sus nodos pasan a empezar en ``node_base`` y su punto ``i`` a ser
+    ``point_map[i]``.
+    """
+    n, p = tree.n_nodes, tree.n_points
+    for arr in (tree.children[:n], tree.parent[:n], tree.leaf[:p]):
+        arr[arr != -1] += node_base
+    for arr in (tree.head[:n], tree.next[:p]):
+        mask = arr != -1
+        arr[mask] = point_map[arr[mask]]
+    tree.parent[0] = parent
+    tree.depth[:n] += depth
+
+
+def parallel_build(points, capacity=1, bounds=None, dtype=np.float64, workers=None, levels=1,
+                   max_depth=32, min_node_size=0.0):
+    """
+    Version en paralelo de ``Octree.from_points``: el mismo arbol, con el id
+    de cada punto igual a su fila en ``points``.
+
+    Los nodos de los primeros ``levels`` niveles (1: ocho subarboles, 2:
+    hasta 64) se dividen aqui; los puntos se copian ordenados por subarbol a
+    un bloque de memoria compartida y cada proceso construye los suyos con
+    ``from_points``.  Despues se renumeran y se copian bajo la raiz.
+    :param workers: procesos del pool (por defecto ``os.cpu_count()``)
+    """
+    dtype = np.dtype(dtype)
+    pts = np.asarray(points, dtype=dtype).reshape(-1, 3)
+    if bounds is None:
+        bounds = (pts.min(axis=0), pts.max(axis=0))
+    lo, hi = (np.asarray(b, dtype) for b in bounds)
+    inside = np.flatnonzero(np.all((pts >= lo) & (pts <= hi), axis=1))
+
+    def split(part):
+        octant, mid = _octants(pts[part.ids], part.lo, part.hi)
+        children = {}
+        for o in np.flatnonzero(np.bincount(octant, minlength=8)):
+            upper = _UPPER[o]
+            children[int(o)] = _Partition(None, np.where(upper, mid, part.lo),
+                                          np.where(upper, part.hi, mid), part.depth + 1,
+                                          part.ids[octant == o])
+        return children
+
+    root = _Partition(None, lo, hi, 0, inside)
+    top, subtrees = _partition(root, split, lambda part: part.depth >= levels or
+                               part.count <= capacity, max_depth, min_node_size)
+
+    order = np.concatenate([part.ids for part, _ in subtrees])
+    shm = SharedMemory(create=True, size=max(order.size * 3 * dtype.itemsize, 1))
+    try:
+        shared = np.ndarray((len(order), 3), dtype, shm.buf)
+        shared[:] = pts[order]
+        del shared
+        jobs = []
+        start = 0
+        for part, _ in subtrees:
+            jobs.append((shm.name, len(order), dtype.str, start, start + part.count,
+                         part.lo, part.hi, capacity, max_depth - part.depth, min_node_size))
+            start += part.count
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_build_shared, *zip(*jobs)))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    tree = Octree(*lo, *hi, capacity=capacity, dtype=dtype, max_depth=max_depth,
+                  min_node_size=min_node_size)
+    n_nodes = len(top) + sum(sub.n_nodes for sub in results)
+    tree._alloc_nodes(n_nodes)
+    tree._alloc_points(len(pts))
+    tree.n_nodes = n_nodes
+    tree.n_points = len(pts)
+    outside = np.ones(len(pts), bool)
+    outside[inside] = False
+    tree._free_points = np.flatnonzero(outside).tolist()
+
+    roots = []
+    base = len(top)
+    start = 0
+    for (part, parent), sub in zip(subtrees, results):
+        point_map = order[start:start + part.count]
+        _shift(sub, base, point_map, part.depth, parent)
+        for name, *_ in tree._node_fields():
+            getattr(tree, name)[base:base + sub.n_nodes] = getattr(sub, name)[:sub.n_nodes]
+        for name, *_ in tree._point_fields():
+            getattr(tree, name)[point_map] = getattr(sub, name)[:sub.n_points]
+        roots.append((base, sub.count[0], sub.total[0], sub.box_min[0], sub.box_max[0]))
+        base += sub.n_nodes
+        start += part.count
+    rows = _top_rows(top, roots, dtype)
+    for name, *_ in tree._node_fields():
+        getattr(tree, name)[:len(top)] = getattr(rows, name)[:len(top)]
+    return tree
+
+
+def _build_shared(name, n, dtype, start, stop, lo, hi, capacity, max_depth, min_node_size):
+    """Trabajo de ``parallel_build``: construye un subarbol desde la memoria compartida."""
+    shm = SharedMemory(name=name)
+    try:
+        pts = np.ndarray((n, 3), dtype, shm.buf)[start:stop].copy()
+    finally:
+        shm.close()
+    tree = Octree.from_points(pts, capacity, bounds=(lo, hi), dtype=dtype,
+                              max_depth=max_depth, min_node_size=min_node_size)
+    # sin filas de sobra, para no mandarlas de vuelta al proceso principal
+    tree._alloc_nodes(tree.n_nodes)
+    tree._alloc_points(tree.n_points)
+    return tree
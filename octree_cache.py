@@ -0,0 +1,217 @@
+"""
+Cache LRU de consultas sobre un ``octree_core.Octree``.
+
+Las vistas y servicios repiten las mismas consultas (la camara quieta
+vuelve a pedir el mismo frustum, el mismo pick pide el mismo radio).
+``QueryCache`` guarda el resultado por region normalizada: las coordenadas
+se redondean a ``decimals`` decimales (la consulta se hace con la region ya
+redondeada), las cajas se ordenan esquina por esquina y los planos de un
+frustum se normalizan.
+
+Cada entrada queda marcada con los nodos de los que depende su resultado
+(el parametro ``touched`` de las consultas).  La cache se registra en
+``tree.observers``; cuando cambian los puntos de una hoja (insertar, borrar,
+mover, repartir los puntos al dividir) se buscan las entradas marcadas en
+esa hoja o en sus ancestros y se descartan solo las cuya region toca la
+caja de la hoja.  Dividir o colapsar no cambia ningun resultado; las
+entradas marcadas en filas liberadas se descartan porque esas filas pueden
+volver a usarse para otro nodo.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _box_overlaps(lo, hi):
+    def overlaps(nlo, nhi):
+        return bool(np.all(nhi >= lo) and np.all(nlo <= hi))
+    return overlaps
+
+
+def _ball_overlaps(center, r):
+    def overlaps(nlo, nhi):
+        d = np.maximum(nlo - center, 0) + np.maximum(center - nhi, 0)
+        return float(d @ d) <= r * r
+    return overlaps
+
+
+def _planes_overlap(planes):
+    normal = planes[:, :3]
+    offset = planes[:, 3]
+    positive = normal >= 0
+
+    def overlaps(nlo, nhi):
+        far = np.where(positive, nhi, nlo)
+        return bool(np.all(np.einsum("kj,kj->k", far, normal) + offset >= 0))
+    return overlaps
+
+
+def _readonly(arr):
+    arr.flags.writeable = False
+    return arr
+
+
+class _Entry:
+    __slots__ = ("result", "tags", "overlaps")
+
+    def __init__(self, result, tags, overlaps):
+        self.result = result
+        self.tags = tags
+        self.overlaps = overlaps
+
+
+class QueryCache:
+    """
+    Cache de ``query_box``, ``query_radius``, ``knn`` y ``query_frustum``.
+
+    Los resultados se devuelven como arreglos de solo lectura compartidos
+    entre aciertos.  ``hits``, ``misses``, ``evictions`` (sacadas por LRU) e
+    ``invalidations`` (sacadas por cambios en el arbol) cuentan lo que paso;
+    si el arbol tiene ``stats`` se cuentan ademas como eventos "cache_*".
+
+    :param maxsize: entradas guardadas como maximo
+    :param decimals: decimales a los que se redondean las coordenadas
+    """
+
+    def __init__(self, tree, maxsize=256, decimals=6):
+        self.tree = tree
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        # nodo -> claves de las entradas marcadas en el
+        self._tags = {}
+        tree.observers.append(self.on_change)
+
+    # ------------------------------------------------------------------
+    # consultas
+    # ------------------------------------------------------------------
+    def _round(self, values):
+        return np.round(np.asarray(values, dtype=np.float64).reshape(-1), self.decimals)
+
+    def query_box(self, lo, hi):
+        a, b = self._round(lo), self._round(hi)
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        key = ("box", tuple(lo.tolist()), tuple(hi.tolist()))
+        return self._get(key, lambda touched: (
+            _readonly(self.tree.query_box(lo, hi, touched=touched)), _box_overlaps(lo, hi)))
+
+    def query_radius(self, point, r, sort=False):
+        c = self._round(point)
+        r = float(np.round(r, self.decimals))
+        key = ("radius", tuple(c.tolist()), r, bool(sort))
+
+        def run(touched):
+            ids, dist = self.tree.query_radius(c, r, sort, touched=touched)
+            return (_readonly(ids), _readonly(dist)), _ball_overlaps(c, r)
+        return self._get(key, run)
+
+    def knn(self, point, k=1):
+        c = self._round(point)
+        key = ("knn", tuple(c.tolist()), int(k))
+
+        def run(touched):
+            ids, dist = self.tree.knn(c, k, touched=touched)
+            # un punto nuevo cambia el resultado si cae dentro de la bola del
+            # k-esimo vecino (o en cualquier lado si hay menos de k)
+            r = dist[-1] if len(ids) == k else np.inf
+            return (_readonly(ids), _readonly(dist)), _ball_overlaps(c, r)
+        return self._get(key, run)
+
+    def query_frustum(self, planes):
+        planes = np.asarray(planes, dtype=np.float64).reshape(-1, 4)
+        planes = planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+        planes = np.round(planes, self.decimals)
+        key = ("frustum", tuple(map(tuple, planes.tolist())))
+        return self._get(key, lambda touched: (
+            _readonly(self.tree.query_frustum(planes, touched=touched)), _planes_overlap(planes)))
+
+    def _get(self, key, run):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._count("hits")
+            return entry.result
+        self._count("misses")
+        touched = []
+        result, overlaps = run(touched)
+        entry = _Entry(result, set(touched), overlaps)
+        self._entries[key] = entry
+        for node in entry.tags:
+            self._tags.setdefault(node, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+            self._count("evictions")
+        return result
+
+    # ------------------------------------------------------------------
+    # invalidacion
+    # ------------------------------------------------------------------
+    def on_change(self, event, nodes):
+        if not self._entries:
+            return
+        tree = self.tree
+        if event == "points":
+            for node in nodes:
+                node = int(node)
+                lo, hi = tree.node_min[node], tree.node_max[node]
+                stale = set()
+                n = node
+                while n != -1:
+                    for key in self._tags.get(n, ()):
+                        if key not in stale and self._entries[key].overlaps(lo, hi):
+                            stale.add(key)
+                    n = int(tree.parent[n])
+                self._invalidate(stale)
+        elif event == "free":
+            stale = set()
+            for node in nodes:
+                stale.update(self._tags.get(int(node), ()))
+            self._invalidate(stale)
+
+    def _invalidate(self, keys):
+        for key in keys:
+            self._drop(key)
+            self._count("invalidations")
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        for node in entry.tags:
+            keys = self._tags[node]
+            keys.discard(key)
+            if not keys:
+                del self._tags[node]
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.tree.stats is not None:
+            self.tree.stats.add_event("cache_" + name)
+
+    # ------------------------------------------------------------------
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+    def close(self):
+        """Deja de observar el arbol y vacia la cache."""
+        self.tree.observers.remove(self.on_change)
+        self.clear()
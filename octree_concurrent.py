@@ -0,0 +1,211 @@
+"""
+Lecturas concurrentes de un ``octree_core.Octree`` mientras un solo
+escritor lo modifica.
+
+El escritor trabaja sobre su propio arbol y cada tanto publica una copia de
+solo lectura (una "foto" con su numero de ``epoch``).  Los lectores toman la
+foto vigente con ``read()`` y consultan sobre ella todo lo que quieran:
+nadie la modifica, asi que nunca ven un ``subdivide`` a medias.  ``read()``
+anota la epoch de la foto mientras el lector la usa (un lock chico, aparte
+del del escritor, que solo se toma para anotar y borrar).
+
+Publicar no copia el arbol entero.  Se anotan las filas que tocan las
+escrituras (los nodos que avisan los observadores, sus ancestros, que
+cambian ``count`` y los agregados, y sus hijos, que pueden ser nuevos; los
+puntos de las hojas avisadas y las filas de punto libres) y se toma una foto
+vieja cuya epoch no tiene lectores anotados: se le copian solo las filas
+tocadas desde su epoch y se vuelve a publicar.  Si no hay una foto libre, o
+el escritor agrando sus arreglos, se copia todo.  Asi publicar cuesta segun lo que se
+escribio y no segun el tamano del arbol; con ``publish_every`` mayor a 1
+ademas se paga una sola vez por varias escrituras.
+
+Las fotos comparten ``stats`` con el escritor (los contadores solo se
+suman), asi que las consultas de los lectores tambien se cuentan.
+"""
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class SnapshotOctree:
+    """
+    Un escritor, muchos lectores.
+
+    ``read()`` da la ultima foto publicada; ``write()`` da acceso exclusivo
+    al arbol del escritor y publica cuando se juntan ``publish_every``
+    escrituras.  ``snapshot`` tambien es la ultima foto, pero leida fuera de
+    ``read()`` se puede reciclar en cualquier publicacion posterior.  ``insert``, ``insert_many``, ``remove``, ``update``,
+    ``update_many``, ``delete`` y ``delete_many`` son atajos de ``write()``.
+
+    :param pool: fotos viejas que se guardan para reciclar
+    """
+
+    def __init__(self, tree, publish_every=1, pool=3):
+        self.tree = tree
+        self.publish_every = publish_every
+        self.pool = pool
+        self.epoch = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+        # epoch -> lectores usando esa foto
+        self._leases = Counter()
+        self._leases_lock = threading.Lock()
+        # nodos avisados desde la ultima publicacion; en ``_leaves`` los de
+        # "points", cuyos puntos cambiaron
+        self._nodes = []
+        self._leaves = []
+        # (epoch, filas de nodo, filas de punto) de las ultimas publicaciones
+        self._history = deque(maxlen=pool + 1)
+        self._retired = []
+        self.snapshot = None
+        tree.observers.append(self._on_change)
+        self.publish()
+
+    def _on_change(self, event, nodes):
+        nodes = np.asarray(nodes, np.int64).reshape(-1)
+        self._nodes.append(nodes)
+        if event == "points":
+            self._leaves.append(nodes)
+
+    def publish(self):
+        """Publica el estado actual del escritor como una nueva foto."""
+        with self._lock:
+            self._publish()
+        return self.snapshot
+
+    def _publish(self):
+        self.epoch += 1
+        self._history.append((self.epoch,) + self._dirty_rows())
+        snap = self._recycle()
+        if snap is None:
+            snap = self._full_copy()
+        snap.epoch = self.epoch
+        self.pending = 0
+        old = self.snapshot
+        # una sola asignacion: los lectores ven la foto vieja o la nueva
+        self.snapshot = snap
+        if old is not None:
+            self._retired.append(old)
+            del self._retired[:-self.pool]
+
+    def _dirty_rows(self):
+        """Filas de nodo y de punto tocadas desde la ultima publicacion."""
+        tree = self.tree
+        nodes = np.concatenate(self._nodes) if self._nodes else np.empty(0, np.int64)
+        leaves = np.concatenate(self._leaves) if self._leaves else np.empty(0, np.int64)
+        self._nodes = []
+        self._leaves = []
+
+        # ancestros (``count`` y agregados) e hijos (pueden ser filas nuevas)
+        rows = [nodes]
+        level = np.unique(nodes)
+        while len(level):
+            level = tree.parent[level].astype(np.int64)
+            level = np.unique(level[level != -1])
+            rows.append(level)
+        nodes = np.unique(np.concatenate(rows))
+        children = tree.children[nodes].ravel().astype(np.int64)
+        nodes = np.union1d(nodes, children[children != -1])
+
+        points = [np.array(tree._free_points, np.int64)]
+        p = tree.head[np.unique(leaves)].astype(np.int64)
+        p = p[p != -1]
+        while len(p):
+            points.append(p)
+            p = tree.next[p].astype(np.int64)
+            p = p[p != -1]
+        return nodes, np.unique(np.concatenate(points))
+
+    @contextmanager
+    def read(self):
+        """
+        Foto vigente para un lector.  Mientras dure el ``with`` la foto no se
+        recicla; sus arreglos (y las vistas de ellos) solo valen hasta ahi.
+        """
+        with self._leases_lock:
+            snap = self.snapshot
+            self._leases[snap.epoch] += 1
+        try:
+            yield snap
+        finally:
+            with self._leases_lock:
+                self._leases[snap.epoch] -= 1
+                if not self._leases[snap.epoch]:
+                    del self._leases[snap.epoch]
+
+    def _recycle(self):
+        """Foto vieja que nadie usa, puesta al dia; None si no hay."""
+        tree = self.tree
+        # una foto retirada ya no es ``snapshot``: sacada de ``_retired`` sin
+        # lectores anotados, nadie mas puede anotarse en ella
+        with self._leases_lock:
+            for i, snap in enumerate(self._retired):
+                if snap.epoch in self._leases:
+                    continue
+                if len(snap.divided) < tree.n_nodes or len(snap.next) < tree.n_points:
+                    continue
+                patches = [h for h in self._history if h[0] > snap.epoch]
+                if patches and patches[0][0] == snap.epoch + 1:
+                    del self._retired[i]
+                    break
+            else:
+                return None
+        nodes = np.unique(np.concatenate([h[1] for h in patches]))
+        points = np.unique(np.concatenate([h[2] for h in patches]))
+        for fields, rows in ((tree._node_fields(), nodes), (tree._point_fields(), points)):
+            for name, *_ in fields:
+                arr = getattr(snap, name)
+                arr.flags.writeable = True
+                arr[rows] = getattr(tree, name)[rows]
+                arr.flags.writeable = False
+        self._copy_scalars(snap)
+        return snap
+
+    def _full_copy(self):
+        # con las filas de sobra, para poder reciclar la foto aunque el
+        # escritor agregue filas
+        return self.tree.copy(readonly=True, spare=True)
+
+    def _copy_scalars(self, snap):
+        tree = self.tree
+        arrays = {name for name, *_ in tree._node_fields() + tree._point_fields()}
+        snap.__dict__.update({k: v for k, v in tree.__dict__.items() if k not in arrays},
+                             observers=[], stats=tree.stats,
+                             _free_nodes=list(tree._free_nodes),
+                             _free_points=list(tree._free_points))
+
+    @contextmanager
+    def write(self):
+        """Acceso exclusivo al arbol del escritor; cuenta como una escritura."""
+        with self._lock:
+            yield self.tree
+            self.pending += 1
+            if self.pending >= self.publish_every:
+                self._publish()
+
+    def _apply(self, method, *args, **kwargs):
+        with self.write() as tree:
+            return getattr(tree, method)(*args, **kwargs)
+
+    def insert(self, x, y, z):
+        return self._apply("insert", x, y, z)
+
+    def insert_many(self, points):
+        return self._apply("insert_many", points)
+
+    def remove(self, p):
+        return self._apply("remove", p)
+
+    def update(self, p, x, y, z):
+        return self._apply("update", p, x, y, z)
+
+    def update_many(self, ids, points):
+        return self._apply("update_many", ids, points)
+
+    def delete(self, x, y, z, tolerance=1e-6):
+        return self._apply("delete", x, y, z, tolerance)
+
+    def delete_many(self, points, tolerance=1e-6):
+        return self._apply("delete_many", points, tolerance)
@@ -0,0 +1,1397 @@
+"""
+Octree de puntos sin dependencias de renderizado (no importa Panda3D).
+
+Los nodos y los puntos se guardan como "struct of arrays": cada campo es un
+arreglo plano de NumPy indexado por el id del nodo o del punto, en lugar de
+objetos ``Point`` y ``Octree`` por nodo.  La numeracion de octantes es la misma
+que ``Octree.get_child_index`` en ``test.py``.
+"""
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from octree_log import TRACE, Dump, get_logger
+from octree_stats import OctreeStats, timed
+
+log = get_logger("core")
+
+# (x > mid) | (y > mid) << 1 | (z > mid) << 2  ->  indice de hijo de test.py
+OCTANT = (0, 1, 3, 2, 4, 5, 7, 6)
+_OCTANT = np.array(OCTANT, dtype=np.int8)
+# para cada octante, que mitad (superior) ocupa en x, y, z
+_UPPER = ((_OCTANT[:, None] >> np.arange(3)) & 1).astype(bool)
+
+# formato de archivo: MAGIC, largo de la cabecera (uint64), cabecera JSON y
+# los arreglos alineados a _ALIGN bytes
+MAGIC = b"OCTREE\x00\x01"
+_ALIGN = 64
+
+
+def _sides(v, mid, tol):
+    """Mitades (0 inferior, 1 superior) donde puede estar un valor a ``tol`` de v."""
+    if v - tol > mid:
+        return (1,)
+    if v + tol <= mid:
+        return (0,)
+    return (0, 1)
+
+
+def file_header(meta, arrays):
+    """
+    Cabecera del formato de ``Octree.save`` para arreglos ``(nombre, dtype,
+    forma)`` que se escriben en ese orden.
+    :return: (bytes de la cabecera, posicion del primer arreglo, meta con la
+        ubicacion de cada arreglo)
+    """
+    layout = {}
+    offset = 0
+    for name, dtype, shape in arrays:
+        layout[name] = (np.dtype(dtype).str, tuple(shape), offset)
+        nbytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+        offset += -(-nbytes // _ALIGN) * _ALIGN
+    meta = dict(meta, arrays=layout)
+    header = json.dumps(meta).encode()
+    header = MAGIC + np.uint64(len(header)).tobytes() + header
+    start = -(-len(header) // _ALIGN) * _ALIGN
+    return header, start, meta
+
+
+# arbol de cada proceso de ``query_batch``
+_worker_tree = None
+
+
+def _init_worker(path):
+    """Inicializa un proceso de ``query_batch`` mapeando el arbol de ``path``."""
+    global _worker_tree
+    _worker_tree = Octree.open(path)
+
+
+def _run_batch(tree, kind, queries, k, r, tolerance):
+    """
+    Ejecuta las consultas de un bloque.
+    :return: (ids, distancias o None, cantidad de resultados por consulta)
+    """
+    ids = []
+    dist = []
+    for q in queries:
+        if kind == "point":
+            p = tree.find(*q, tolerance=tolerance)
+            ids.append(np.array([] if p is None else [p], np.int64))
+        elif kind == "knn":
+            i, d = tree.knn(q, k)
+            ids.append(i)
+            dist.append(d)
+        elif kind == "radius":
+            i, d = tree.query_radius(q, r, sort=True)
+            ids.append(i)
+            dist.append(d)
+        else:
+            ids.append(tree.query_box(q[0], q[1]))
+    counts = np.array([len(i) for i in ids], np.int64)
+    ids = np.concatenate(ids) if ids else np.empty(0, np.int64)
+    dist = np.concatenate(dist) if dist else None
+    return ids, dist, counts
+
+
+def _run_batch_worker(kind, queries, k, r, tolerance):
+    return _run_batch(_worker_tree, kind, queries, k, r, tolerance)
+
+
+def _pad(results, width):
+    """Junta resultados (ids, dist) de distinto largo en arreglos (m, width)."""
+    ids = np.full((len(results), width), -1, np.int64)
+    dist = np.full((len(results), width), np.inf)
+    for row, (i, d) in enumerate(results):
+        ids[row, :len(i)] = i
+        dist[row, :len(d)] = d
+    return ids, dist
+
+
+class Octree:
+    """
+    Octree de puntos con almacenamiento plano.
+
+    Nodos:  ``node_min``/``node_max`` (n, 3), ``children`` (n, 8) con -1 si no
+    hay hijo, ``divided``, ``parent``, ``depth``, ``count`` (puntos en el
+    subarbol) y ``head`` (primer punto de la hoja).  Cada nodo lleva ademas
+    datos agregados de su subarbol: ``total`` (suma de coordenadas, el
+    centroide es ``total / count``) y ``box_min``/``box_max`` (caja de los
+    puntos).  Se mantienen al insertar; al borrar o mover puntos la caja
+    puede quedar mas grande de lo justo (sigue conteniendo todo) hasta que
+    se llame a ``refresh_boxes``.
+    Puntos: ``coords`` (n, 3), ``next`` (siguiente punto de la misma hoja, -1
+    al final) y ``leaf`` (hoja que contiene el punto).
+
+    ``observers`` es una lista de funciones ``f(evento, nodos)`` que se llaman
+    cuando cambia la estructura: "split" (el nodo paso a estar dividido),
+    "merge" (volvio a ser hoja), "free" (filas liberadas), "points" (cambio
+    el conjunto o la posicion de los puntos de la hoja) y "boxes" (se
+    recalcularon las cajas de los nodos, ver ``refresh_boxes``).  Sirve para que las
+    vistas y caches actualicen solo lo que cambio.
+
+    Un nodo no se divide si ya esta a profundidad ``max_depth`` o si su lado
+    mas largo mide ``min_node_size`` o menos; esa hoja guarda todos los
+    puntos que le lleguen aunque pasen de ``capacity`` (hoja "balde"), asi
+    muchos puntos repetidos no provocan divisiones sin fin.
+
+    Solo las primeras ``n_nodes`` / ``n_points`` filas estan en uso y entre
+    ellas puede haber filas libres (``depth`` -1 en nodos, ``leaf`` -1 en
+    puntos) que se reutilizan al insertar.  Los arreglos se reemplazan al
+    crecer, asi que no conviene guardar referencias.
+    """
+
+    def __init__(self, x1, y1, z1, x2, y2, z2, capacity=1, dtype=np.float64,
+                 max_depth=32, min_node_size=0.0):
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.min_node_size = min_node_size
+        self.dtype = np.dtype(dtype)
+        self.n_nodes = 0
+        self.n_points = 0
+        self._free_nodes = []
+        self._free_points = []
+        self.observers = []
+        self.stats = None
+        self._alloc_nodes(16)
+        self._alloc_points(16)
+        self._new_node((x1, y1, z1), (x2, y2, z2), -1, 0)
+
+    def enable_stats(self):
+        """Empieza a juntar estadisticas en ``self.stats`` (ver ``octree_stats``)."""
+        if self.stats is None:
+            self.stats = OctreeStats()
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+    # ------------------------------------------------------------------
+    # almacenamiento
+    # ------------------------------------------------------------------
+    def _node_fields(self):
+        """(nombre, forma de una fila, dtype, valor de relleno) de cada arreglo de nodos."""
+        return (
+            ("node_min", (3,), self.dtype, 0),
+            ("node_max", (3,), self.dtype, 0),
+            ("children", (8,), np.int32, -1),
+            ("divided", (), np.bool_, False),
+            ("parent", (), np.int32, -1),
+            ("depth", (), np.int16, 0),
+            ("count", (), np.int64, 0),
+            ("head", (), np.int32, -1),
+            ("total", (3,), np.float64, 0),
+            ("box_min", (3,), np.float64, np.inf),
+            ("box_max", (3,), np.float64, -np.inf),
+        )
+
+    def _point_fields(self):
+        """Como ``_node_fields`` para los arreglos de puntos."""
+        return (
+            ("coords", (3,), self.dtype, 0),
+            ("next", (), np.int32, -1),
+            ("leaf", (), np.int32, -1),
+        )
+
+    def _alloc_nodes(self, size):
+        old = self.n_nodes
+        for name, shape, dtype, fill in self._node_fields():
+            arr = np.full((size,) + shape, fill, dtype)
+            if old:
+                arr[:old] = getattr(self, name)[:old]
+            setattr(self, name, arr)
+
+    def _alloc_points(self, size):
+        old = self.n_points
+        for name, shape, dtype, fill in self._point_fields():
+            arr = np.full((size,) + shape, fill, dtype)
+            if old:
+                arr[:old] = getattr(self, name)[:old]
+            setattr(self, name, arr)
+
+    def _reserve_nodes(self, extra):
+        need = self.n_nodes + extra
+        if need > len(self.divided):
+            self._alloc_nodes(max(need, 2 * len(self.divided)))
+
+    def _reserve_points(self, extra):
+        need = self.n_points + extra
+        if need > len(self.next):
+            self._alloc_points(max(need, 2 * len(self.next)))
+
+    def _take_nodes(self, k):
+        """Ids de ``k`` filas de nodo, primero las libres."""
+        reuse = self._free_nodes[max(len(self._free_nodes) - k, 0):] if k else []
+        del self._free_nodes[len(self._free_nodes) - len(reuse):]
+        extra = k - len(reuse)
+        self._reserve_nodes(extra)
+        rows = np.concatenate([np.array(reuse, np.int64),
+                               np.arange(self.n_nodes, self.n_nodes + extra)])
+        self.n_nodes += extra
+        return rows
+
+    def _take_points(self, k):
+        """Ids de ``k`` filas de punto, primero las libres."""
+        reuse = self._free_points[max(len(self._free_points) - k, 0):] if k else []
+        del self._free_points[len(self._free_points) - len(reuse):]
+        extra = k - len(reuse)
+        self._reserve_points(extra)
+        rows = np.concatenate([np.array(reuse, np.int64),
+                               np.arange(self.n_points, self.n_points + extra)])
+        self.n_points += extra
+        return rows
+
+    def _free_subtree(self, node, rows=None):
+        """
+        Libera las filas de los descendientes de ``node`` (no el nodo).
+        :param rows: esos descendientes, si ya se conocen
+        """
+        if rows is None:
+            rows = []
+            stack = [c for c in self.children[node] if c != -1]
+            while stack:
+                n = stack.pop()
+                rows.append(n)
+                stack.extend(c for c in self.children[n] if c != -1)
+        rows = np.array(rows, np.int64)
+        self.children[rows] = -1
+        self.divided[rows] = False
+        self.parent[rows] = -1
+        self.depth[rows] = -1
+        self.count[rows] = 0
+        self.head[rows] = -1
+        self.total[rows] = 0
+        self.box_min[rows] = np.inf
+        self.box_max[rows] = -np.inf
+        self.children[node] = -1
+        self.divided[node] = False
+        self._free_nodes.extend(rows.tolist())
+        if self.observers:
+            self._notify("free", rows)
+            self._notify("merge", (node,))
+
+    def _add_stats(self, node, xyz):
+        """Suma un punto a los agregados de ``node`` (sin ``count``)."""
+        self.total[node] += xyz
+        np.minimum(self.box_min[node], xyz, out=self.box_min[node])
+        np.maximum(self.box_max[node], xyz, out=self.box_max[node])
+
+    def _move_stats(self, nodes, old, new):
+        """
+        Corrige los agregados de ``nodes[i]`` y sus ancestros cuando un punto
+        que ya cuentan pasa de ``old[i]`` a ``new[i]``.
+        """
+        nodes = np.asarray(nodes, np.int64).reshape(-1)
+        delta = np.asarray(new, np.float64).reshape(-1, 3) - old
+        new = np.asarray(new, np.float64).reshape(-1, 3)
+        while len(nodes):
+            np.add.at(self.total, nodes, delta)
+            np.minimum.at(self.box_min, nodes, new)
+            np.maximum.at(self.box_max, nodes, new)
+            nodes = self.parent[nodes]
+            up = nodes != -1
+            nodes, delta, new = nodes[up], delta[up], new[up]
+
+    def _notify(self, event, nodes):
+        for observer in self.observers:
+            observer(event, nodes)
+
+    def _new_node(self, lo, hi, parent, depth):
+        self._reserve_nodes(1)
+        n = self.n_nodes
+        self.node_min[n] = lo
+        self.node_max[n] = hi
+        self.parent[n] = parent
+        self.depth[n] = depth
+        self.n_nodes += 1
+        return n
+
+    def _new_children(self, nodes, octants):
+        """Crea el hijo ``octants[i]`` de cada nodo ``nodes[i]`` de una sola vez."""
+        new = self._take_nodes(len(nodes))
+        lo = self.node_min[nodes]
+        hi = self.node_max[nodes]
+        mid = (lo + hi) / 2
+        upper = _UPPER[octants]
+        self.node_min[new] = np.where(upper, mid, lo)
+        self.node_max[new] = np.where(upper, hi, mid)
+        self.parent[new] = nodes
+        self.depth[new] = self.depth[nodes] + 1
+        self.children[nodes, octants] = new
+        return new
+
+    def _child(self, node, index):
+        """Hijo ``index`` de ``node``; se crea la primera vez que se necesita."""
+        child = self.children[node, index]
+        if child == -1:
+            child = self._new_children(np.array([node]), np.array([index]))[0]
+        return child
+
+    def _link(self, node, p):
+        """Agrega el punto ``p`` a la lista de la hoja ``node``."""
+        self.next[p] = self.head[node]
+        self.head[node] = p
+        self.leaf[p] = node
+        if self.observers:
+            self._notify("points", (node,))
+
+    def _link_many(self, nodes, ids):
+        """Version vectorizada de ``_link``: ``ids[i]`` va a la hoja ``nodes[i]``."""
+        if not len(ids):
+            return
+        order = np.argsort(nodes, kind="stable")
+        nodes = nodes[order]
+        ids = ids[order]
+        first = np.r_[True, nodes[1:] != nodes[:-1]]
+        last = np.r_[nodes[1:] != nodes[:-1], True]
+        nxt = np.empty_like(ids)
+        nxt[:-1] = ids[1:]
+        nxt[last] = self.head[nodes[last]]
+        self.next[ids] = nxt
+        self.head[nodes[first]] = ids[first]
+        self.leaf[ids] = nodes
+        if self.observers:
+            self._notify("points", nodes[first])
+
+    # ------------------------------------------------------------------
+    # geometria
+    # ------------------------------------------------------------------
+    def contains(self, node, x, y, z):
+        lo = self.node_min[node]
+        hi = self.node_max[node]
+        return (lo[0] <= x <= hi[0] and
+                lo[1] <= y <= hi[1] and
+                lo[2] <= z <= hi[2])
+
+    def _fits(self, node, x, y, z):
+        """
+        Si (x, y, z) cae en ``node`` segun ``get_child_index``: la caja es
+        semiabierta por abajo salvo en las caras de la raiz.
+        """
+        lo = self.node_min[node]
+        hi = self.node_max[node]
+        root = self.node_min[0]
+        return ((x > lo[0] or lo[0] == root[0]) and x <= hi[0] and
+                (y > lo[1] or lo[1] == root[1]) and y <= hi[1] and
+                (z > lo[2] or lo[2] == root[2]) and z <= hi[2])
+
+    def _fits_many(self, nodes, xyz):
+        """``_fits`` vectorizado."""
+        lo = self.node_min[nodes]
+        hi = self.node_max[nodes]
+        above = (xyz > lo) | (lo == self.node_min[0])
+        return np.all(above & (xyz <= hi), axis=1)
+
+    def can_split(self, node):
+        return (self.depth[node] < self.max_depth and
+                (self.node_max[node] - self.node_min[node]).max() > self.min_node_size)
+
+    def can_split_many(self, nodes):
+        """``can_split`` vectorizado."""
+        size = (self.node_max[nodes] - self.node_min[nodes]).max(axis=1)
+        return (self.depth[nodes] < self.max_depth) & (size > self.min_node_size)
+
+    def get_child_index(self, node, x, y, z):
+        mid = (self.node_min[node] + self.node_max[node]) / 2
+        return OCTANT[(x > mid[0]) | (y > mid[1]) << 1 | (z > mid[2]) << 2]
+
+    def get_child_indices(self, nodes, xyz):
+        """``get_child_index`` vectorizado para puntos ``xyz`` (n, 3)."""
+        mid = self.node_min[nodes]
+        mid += self.node_max[nodes]
+        mid *= 0.5
+        gt = (xyz > mid).view(np.uint8)
+        return _OCTANT[gt[:, 0] | gt[:, 1] << 1 | gt[:, 2] << 2]
+
+    def child_bounds(self, node, index):
+        """Limites (min, max) del octante ``index`` del nodo."""
+        lo = self.node_min[node]
+        hi = self.node_max[node]
+        mid = (lo + hi) / 2
+        bits = OCTANT[index]
+        upper = np.array([bits & 1, bits & 2, bits & 4], dtype=bool)
+        return np.where(upper, mid, lo), np.where(upper, hi, mid)
+
+    # ------------------------------------------------------------------
+    # operaciones
+    # ------------------------------------------------------------------
+    def subdivide(self, node):
+        """
+        Marca el nodo como dividido y reparte sus puntos; solo se crean los
+        hijos que reciben algun punto, el resto se crea en ``_child``.
+        """
+        self.divided[node] = True
+        if self.stats is not None:
+            self.stats.add_event("subdivide")
+        if self.observers:
+            self._notify("split", (node,))
+
+        p = self.head[node]
+        self.head[node] = -1
+        while p != -1:
+            nxt = self.next[p]
+            x, y, z = self.coords[p]
+            child = self._child(node, self.get_child_index(node, x, y, z))
+            self._link(child, p)
+            self.count[child] += 1
+            self._add_stats(child, self.coords[p])
+            p = nxt
+
+    @timed("insert")
+    def insert(self, x, y, z):
+        if not self.contains(0, x, y, z):
+            return False
+
+        p = int(self._take_points(1)[0])
+        self.coords[p] = (x, y, z)
+        if self.stats is not None:
+            self.stats.add_event("points_inserted")
+        self._place(0, p)
+        return True
+
+    def _place(self, node, p):
+        """Baja el punto ``p`` desde ``node`` hasta una hoja y lo enlaza."""
+        xyz = self.coords[p]
+        x, y, z = xyz
+        while True:
+            if not self.divided[node]:
+                if self.count[node] < self.capacity or not self.can_split(node):
+                    break
+                self.subdivide(node)
+            self.count[node] += 1
+            self._add_stats(node, xyz)
+            node = self._child(node, self.get_child_index(node, x, y, z))
+
+        self.count[node] += 1
+        self._add_stats(node, xyz)
+        self._link(node, p)
+
+    @timed("insert_many")
+    def insert_many(self, points):
+        """
+        Inserta un arreglo de puntos (n, 3) repartiendolo por octantes nivel a
+        nivel con operaciones vectorizadas.
+        :return: ids de los puntos insertados, -1 para los que quedan fuera
+        """
+        pts = np.asarray(points, dtype=self.dtype).reshape(-1, 3)
+        inside = np.all((pts >= self.node_min[0]) & (pts <= self.node_max[0]), axis=1)
+        ids = np.full(len(pts), -1, np.int64)
+        new = self._take_points(int(inside.sum()))
+        self.coords[new] = pts[inside]
+        ids[inside] = new
+
+        if self.stats is not None:
+            self.stats.add_event("points_inserted", len(new))
+        self._descend(new, np.zeros(len(new), np.int64), np.full(len(new), -1))
+        log.debug("insert_many: %d puntos, %d fuera, %d nodos", len(new),
+                  len(pts) - len(new), self.n_nodes)
+        log.log(TRACE, "arbol:\n%s", Dump(self.dump))
+        return ids
+
+    def _group(self, values, size):
+        """
+        Valores distintos de ``values`` (enteros en ``[0, size)``), ordenados, y
+        cuantas veces aparece cada uno.
+        """
+        if len(values) * 8 < size:
+            return np.unique(values, return_counts=True)
+        # lote grande: contar sobre todo el rango es mas barato que ordenar
+        k = np.bincount(values, minlength=size)
+        distinct = np.flatnonzero(k)
+        return distinct, k[distinct]
+
+    def _descend(self, new, node, stop):
+        """
+        Baja los puntos ``new`` (con coordenadas ya cargadas) desde los nodos
+        ``node`` hasta sus hojas, dividiendo las que se pasan de ``capacity``,
+        y suma sus agregados hasta ``stop`` (ver ``_add_stats_many``).
+        Cada nivel trabaja solo con los nodos por los que pasan los puntos,
+        asi un lote chico no recorre el arbol entero.
+        """
+        # puntos que ya estaban y se reparten al dividir su hoja: cuentan en los
+        # agregados solo por debajo de esa hoja.  Todos los puntos bajan un
+        # nivel por vuelta, asi que una hoja enlazada en este lote no vuelve a
+        # dividirse en el mismo lote y cada punto viejo se mueve una sola vez.
+        moved = []
+        moved_from = []
+
+        pid = new
+        while len(pid):
+            touched, k = self._group(node, self.n_nodes)
+            self.count[touched] += k
+            at_leaf = ~self.divided[node]
+            split = at_leaf & (self.count[node] > self.capacity)
+            if split.any():
+                split[split] = self.can_split_many(node[split])
+            fits = at_leaf & ~split
+            self._link_many(node[fits], pid[fits])
+            full = self._group(node[split], self.n_nodes)[0]
+            pid, node = pid[~fits], node[~fits]
+            if len(full):
+                old = [(n, self.node_points(n)) for n in full if self.head[n] != -1]
+                self.head[full] = -1
+                self.divided[full] = True
+                if self.stats is not None:
+                    self.stats.add_event("subdivide", len(full))
+                if self.observers:
+                    self._notify("split", full)
+                if old:
+                    old_ids = [np.array(o, np.int64) for _, o in old]
+                    old_nodes = [np.full(len(o), n, np.int64) for n, o in old]
+                    pid = np.concatenate([pid] + old_ids)
+                    node = np.concatenate([node] + old_nodes)
+                    moved += old_ids
+                    moved_from += old_nodes
+            octant = self.get_child_indices(node, self.coords[pid])
+            child = self.children[node, octant].astype(np.int64)
+            missing = child == -1
+            if missing.any():
+                key = self._group(node[missing] * 8 + octant[missing], 8 * self.n_nodes)[0]
+                self._new_children(key // 8, key % 8)
+                child[missing] = self.children[node[missing], octant[missing]]
+            node = child
+
+        self._add_stats_many(np.concatenate([new] + moved),
+                             np.concatenate([stop] + moved_from))
+
+    def _add_stats_many(self, ids, stop):
+        """
+        Suma los puntos ``ids`` (ya enlazados en sus hojas) a ``total`` y a
+        las cajas de su hoja y sus ancestros; en ``total`` se deja de sumar
+        desde el nodo ``stop[i]`` hacia arriba (-1: se suma hasta la raiz).
+        Se acumula una vez por hoja y luego se sube nivel a nivel por los
+        nodos tocados, en lugar de sumar cada punto en cada nivel.  Los
+        acumuladores tienen una fila por nodo tocado, no por nodo del arbol.
+        """
+        if not len(ids):
+            return
+        xyz = self.coords[ids]
+        leaf = self.leaf[ids].astype(np.int64)
+        stopped = stop != -1
+
+        # hojas y todos sus ancestros, ordenados para ubicarlos con searchsorted
+        n = self.n_nodes
+        level = self._group(leaf, n)[0]
+        chain = [level]
+        while len(level):
+            level = self.parent[level].astype(np.int64)
+            level = self._group(level[level != -1], n)[0]
+            chain.append(level)
+        touched = self._group(np.concatenate(chain), n)[0]
+        m = len(touched)
+        if m * 8 < n:
+            def row(nodes):
+                return np.searchsorted(touched, nodes)
+        else:
+            # muchos nodos tocados: una tabla directa es mas rapida que buscar
+            table = np.empty(n, np.int64)
+            table[touched] = np.arange(m)
+
+            def row(nodes):
+                return table[nodes]
+        at_leaf = row(leaf)
+        at_stop = row(stop[stopped])
+
+        delta = np.zeros((m, 3))
+        lo = np.full((m, 3), np.inf)
+        hi = np.full((m, 3), -np.inf)
+        for axis in range(3):
+            delta[:, axis] = (np.bincount(at_leaf, xyz[:, axis], minlength=m) -
+                              np.bincount(at_stop, xyz[stopped, axis], minlength=m))
+            # ``ufunc.at`` es mucho mas rapido en 1-D que con filas (n, 3)
+            np.minimum.at(lo[:, axis], at_leaf, xyz[:, axis])
+            np.maximum.at(hi[:, axis], at_leaf, xyz[:, axis])
+
+        depth = self.depth[touched]
+        for d in range(int(depth.max()), 0, -1):
+            level = np.flatnonzero(depth == d)
+            up = row(self.parent[touched[level]])
+            for axis in range(3):
+                delta[:, axis] += np.bincount(up, delta[level, axis], minlength=m)
+                np.minimum.at(lo[:, axis], up, lo[level, axis])
+                np.maximum.at(hi[:, axis], up, hi[level, axis])
+        self.total[touched] += delta
+        self.box_min[touched] = np.minimum(self.box_min[touched], lo)
+        self.box_max[touched] = np.maximum(self.box_max[touched], hi)
+
+    @classmethod
+    def from_points(cls, points, capacity=1, bounds=None, dtype=np.float64, **kwargs):
+        """
+        Construye un octree de una sola pasada a partir de un arreglo (n, 3).
+        :param bounds: (min, max); por defecto la caja envolvente de los puntos
+        :param kwargs: ``max_depth`` / ``min_node_size`` del constructor
+        """
+        pts = np.asarray(points, dtype=dtype).reshape(-1, 3)
+        if bounds is None:
+            bounds = (pts.min(axis=0), pts.max(axis=0))
+        lo, hi = bounds
+        tree = cls(*lo, *hi, capacity=capacity, dtype=dtype, **kwargs)
+        tree._reserve_points(len(pts))
+        tree.insert_many(pts)
+        return tree
+
+    @timed("find")
+    def find(self, x, y, z, tolerance=1e-6):
+        """
+        Busca un punto guardado a distancia ``tolerance`` (por eje) de
+        (x, y, z) bajando solo por los octantes que elige ``get_child_index``;
+        si la coordenada esta a menos de ``tolerance`` del punto medio se
+        revisan los dos lados.
+        :return: id del punto encontrado o None
+        """
+        tol = tolerance
+        lo = self.node_min[0]
+        hi = self.node_max[0]
+        if not (lo[0] - tol <= x <= hi[0] + tol and
+                lo[1] - tol <= y <= hi[1] + tol and
+                lo[2] - tol <= z <= hi[2] + tol):
+            return None
+
+        found = None
+        visited = tested = 0
+        stack = [0]
+        while stack and found is None:
+            node = stack.pop()
+            visited += 1
+            if not self.divided[node]:
+                p = self.head[node]
+                while p != -1:
+                    tested += 1
+                    px, py, pz = self.coords[p]
+                    if abs(px - x) <= tol and abs(py - y) <= tol and abs(pz - z) <= tol:
+                        found = int(p)
+                        break
+                    p = self.next[p]
+                continue
+            mx, my, mz = (self.node_min[node] + self.node_max[node]) / 2
+            for bz in _sides(z, mz, tol):
+                for by in _sides(y, my, tol):
+                    for bx in _sides(x, mx, tol):
+                        child = self.children[node, OCTANT[bx | by << 1 | bz << 2]]
+                        if child != -1:
+                            stack.append(child)
+        if self.stats is not None:
+            self.stats.add_query("find", visited, tested)
+        return found
+
+    def search(self, x, y, z, tolerance=1e-6):
+        return self.find(x, y, z, tolerance) is not None
+
+    @timed("remove")
+    def remove(self, p):
+        """
+        Quita el punto con id ``p``.  Si algun ancestro queda con ``capacity``
+        puntos o menos, el mas alto de ellos se colapsa de nuevo en una hoja
+        y las filas de su subarbol quedan libres.
+        :return: False si ``p`` no existe (ids negativos, como el -1 de los
+            puntos rechazados por ``insert_many``, o fuera de rango)
+        """
+        if not 0 <= p < self.n_points:
+            return False
+        node = int(self.leaf[p])
+        if node == -1:
+            return False
+        self._unlink(p)
+        self._free_points.append(int(p))
+
+        top = -1
+        xyz = self.coords[p]
+        while node != -1:
+            self.count[node] -= 1
+            self.total[node] -= xyz
+            if self.divided[node] and self.count[node] <= self.capacity:
+                top = node
+            node = int(self.parent[node])
+        if top != -1:
+            self.collapse(top)
+        return True
+
+    def _unlink(self, p):
+        """Saca el punto ``p`` de la lista de su hoja (no toca ``count``)."""
+        node = self.leaf[p]
+        prev = -1
+        q = self.head[node]
+        while q != p:
+            prev, q = q, self.next[q]
+        if prev == -1:
+            self.head[node] = self.next[p]
+        else:
+            self.next[prev] = self.next[p]
+        self.next[p] = -1
+        self.leaf[p] = -1
+        if self.observers:
+            self._notify("points", (node,))
+
+    @timed("update")
+    def update(self, p, x, y, z):
+        """
+        Mueve el punto ``p`` a (x, y, z).  Si sigue dentro de su hoja solo se
+        cambian sus coordenadas; si no, se sube hasta el ancestro comun mas
+        bajo que contiene la nueva posicion y se baja desde ahi.
+        :return: False si ``p`` no existe o la nueva posicion queda fuera
+        """
+        if not 0 <= p < self.n_points:
+            return False
+        node = int(self.leaf[p])
+        if node == -1 or not self.contains(0, x, y, z):
+            return False
+        new = np.array((x, y, z), dtype=self.dtype)
+        if self._fits(node, x, y, z):
+            self._move_stats(node, self.coords[p], new)
+            self.coords[p] = new
+            if self.observers:
+                self._notify("points", (node,))
+            return True
+
+        self._unlink(p)
+        old = self.coords[p].copy()
+        top = -1
+        while True:
+            self.count[node] -= 1
+            self.total[node] -= old
+            if self._fits(node, x, y, z):
+                break
+            if self.divided[node] and self.count[node] <= self.capacity:
+                top = node
+            node = int(self.parent[node])
+        if top != -1:
+            self.collapse(top)
+        # por encima de ``node`` el punto sigue contado; solo cambia su posicion
+        if node != 0:
+            self._move_stats(self.parent[node], old, new)
+        self.coords[p] = new
+        self._place(node, p)
+        return True
+
+    @timed("update_many")
+    def update_many(self, ids, points):
+        """
+        ``update`` en lote.  Los puntos que siguen dentro de su hoja se
+        mueven con una sola asignacion vectorizada; el resto uno por uno.
+        Si un id aparece varias veces vale su ultima posicion; los ids que no
+        existen (negativos o fuera de rango) se ignoran.
+        :return: mascara con los puntos que se movieron (las filas repetidas
+            llevan el resultado de la ultima)
+        """
+        all_ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        all_pts = np.asarray(points, dtype=self.dtype).reshape(-1, 3)
+        # ultima aparicion de cada id: con repetidos los agregados se
+        # corregirian una vez por fila partiendo de las mismas coordenadas
+        _, first = np.unique(all_ids[::-1], return_index=True)
+        last = len(all_ids) - 1 - first
+        ids, pts = all_ids[last], all_pts[last]
+        # -1 es una fila valida para NumPy: los ids inexistentes no se leen
+        valid = (ids >= 0) & (ids < self.n_points)
+        leaf = np.full(len(ids), -1, np.int64)
+        leaf[valid] = self.leaf[ids[valid]]
+        stay = (leaf != -1)
+        stay[stay] = self._fits_many(leaf[stay], pts[stay])
+        self._move_stats(leaf[stay], self.coords[ids[stay]], pts[stay])
+        self.coords[ids[stay]] = pts[stay]
+        if self.observers and stay.any():
+            self._notify("points", np.unique(leaf[stay]))
+        moved = stay.copy()
+        for i in np.nonzero(~stay & (leaf != -1))[0]:
+            moved[i] = self.update(ids[i], *pts[i])
+        return moved[np.searchsorted(ids, all_ids)] if len(ids) else moved
+
+    def collapse(self, node):
+        """Convierte ``node`` en hoja con todos los puntos de su subarbol."""
+        if self.stats is not None:
+            self.stats.add_event("collapse")
+        ids = self.subtree_points(node)
+        self._free_subtree(node)
+        self.head[node] = -1
+        self._link_many(np.full(len(ids), node, np.int64), ids)
+
+    @timed("rebuild")
+    def rebuild(self, node=0):
+        """
+        Vuelve a armar el subarbol de ``node`` con la ``capacity`` actual:
+        libera sus descendientes y baja otra vez todos sus puntos de una vez,
+        como ``insert_many``.  Los ids de los puntos no cambian.
+        :return: cantidad de puntos reubicados
+        """
+        # el subarbol se junta nivel a nivel y los puntos siguiendo las listas
+        # de todas sus hojas a la vez: recorrerlo nodo a nodo es mucho mas
+        # lento cuando es grande
+        rows = []
+        level = np.array([node], np.int64)
+        while len(level):
+            rows.append(level)
+            level = self.children[level].ravel().astype(np.int64)
+            level = level[level != -1]
+        rows = np.concatenate(rows)
+        ids = []
+        p = self.head[rows[~self.divided[rows]]].astype(np.int64)
+        p = p[p != -1]
+        while len(p):
+            ids.append(p)
+            p = self.next[p].astype(np.int64)
+            p = p[p != -1]
+        ids = np.concatenate(ids) if ids else np.empty(0, np.int64)
+        if self.stats is not None:
+            self.stats.add_event("rebuild")
+        self._free_subtree(node, rows[1:])
+        self.head[node] = -1
+        self.count[node] = 0
+        self.total[node] = 0
+        self.box_min[node] = np.inf
+        self.box_max[node] = -np.inf
+        self.leaf[ids] = -1
+        self.next[ids] = -1
+        self._descend(ids, np.full(len(ids), node, np.int64),
+                      np.full(len(ids), self.parent[node], np.int64))
+        log.debug("rebuild: nodo %d, %d puntos", node, len(ids))
+        return len(ids)
+
+    @timed("delete")
+    def delete(self, x, y, z, tolerance=1e-6):
+        p = self.find(x, y, z, tolerance)
+        return p is not None and self.remove(p)
+
+    @timed("delete_many")
+    def delete_many(self, points, tolerance=1e-6):
+        """
+        ``delete`` para cada fila de ``points`` (n, 3).
+        :return: mascara con los puntos que se borraron
+        """
+        return np.array([self.delete(x, y, z, tolerance)
+                         for x, y, z in np.asarray(points).reshape(-1, 3)], dtype=bool)
+
+    # ------------------------------------------------------------------
+    # vecinos
+    # ------------------------------------------------------------------
+    def _children_dist2(self, node, q):
+        """Hijos no vacios de ``node`` y su distancia^2 minima a ``q``."""
+        ch = self.children[node]
+        ch = ch[ch != -1]
+        ch = ch[self.count[ch] > 0]
+        d = np.maximum(self.node_min[ch] - q, 0) + np.maximum(q - self.node_max[ch], 0)
+        return ch, np.einsum("ij,ij->i", d, d)
+
+    def _leaf_dist2(self, node, q):
+        ids = np.array(self.node_points(node), dtype=np.int64)
+        d = self.coords[ids] - q
+        return ids, np.einsum("ij,ij->i", d, d)
+
+    @timed("knn")
+    def knn(self, point, k=1, touched=None):
+        """
+        Los ``k`` puntos mas cercanos a ``point`` con un recorrido best-first:
+        los nodos salen de un heap por su distancia a la caja
+        ``node_min``/``node_max`` y se corta cuando ninguno puede mejorar el
+        k-esimo candidato.
+        :param touched: lista donde anotar los nodos de los que depende el
+            resultado (ver ``octree_cache``)
+        :return: (ids, distancias) ordenados de menor a mayor distancia
+        """
+        if k < 1:
+            raise ValueError(f"k debe ser al menos 1: {k}")
+        q = np.asarray(point, dtype=np.float64)
+        best = []  # max-heap (-d2, id) con a lo sumo k elementos
+        nodes = [(0.0, 0)]
+        visited = tested = 0
+        while nodes:
+            d2, node = heapq.heappop(nodes)
+            if len(best) == k and d2 > -best[0][0]:
+                break
+            visited += 1
+            if self.divided[node]:
+                ch, cd2s = self._children_dist2(node, q)
+                if touched is not None and len(ch) < 8:
+                    touched.append(node)
+                for child, cd2 in zip(ch, cd2s):
+                    if len(best) < k or cd2 <= -best[0][0]:
+                        heapq.heappush(nodes, (cd2, int(child)))
+                continue
+            if touched is not None:
+                touched.append(node)
+            ids, pd2s = self._leaf_dist2(node, q)
+            tested += len(ids)
+            for p, pd2 in zip(ids, pd2s):
+                if len(best) < k:
+                    heapq.heappush(best, (-pd2, int(p)))
+                elif pd2 < -best[0][0]:
+                    heapq.heapreplace(best, (-pd2, int(p)))
+        if self.stats is not None:
+            self.stats.add_query("knn", visited, tested)
+        best.sort(reverse=True)
+        ids = np.array([p for _, p in best], dtype=np.int64)
+        dist = np.sqrt(np.array([-d2 for d2, _ in best], dtype=np.float64))
+        return ids, dist
+
+    @timed("query_radius")
+    def query_radius(self, point, r, sort=False, touched=None):
+        """
+        Puntos a distancia <= ``r`` de ``point``; se descartan los nodos cuya
+        caja queda mas lejos que ``r``.
+        :param touched: como en ``knn``
+        :return: (ids, distancias), ordenados por distancia si ``sort``
+        """
+        q = np.asarray(point, dtype=np.float64)
+        r2 = r * r
+        ids = []
+        dist2 = []
+        stack = [0]
+        visited = tested = 0
+        while stack:
+            node = stack.pop()
+            visited += 1
+            if self.divided[node]:
+                ch, cd2 = self._children_dist2(node, q)
+                if touched is not None and len(ch) < 8:
+                    touched.append(node)
+                stack.extend(ch[cd2 <= r2].tolist())
+                continue
+            if touched is not None:
+                touched.append(node)
+            p, pd2 = self._leaf_dist2(node, q)
+            tested += len(p)
+            keep = pd2 <= r2
+            ids.append(p[keep])
+            dist2.append(pd2[keep])
+        if self.stats is not None:
+            self.stats.add_query("query_radius", visited, tested)
+        ids = np.concatenate(ids) if ids else np.empty(0, np.int64)
+        dist = np.sqrt(np.concatenate(dist2)) if dist2 else np.empty(0)
+        if sort:
+            order = np.argsort(dist, kind="stable")
+            ids, dist = ids[order], dist[order]
+        return ids, dist
+
+    def knn_batch(self, points, k=1):
+        """
+        ``knn`` para cada fila de ``points`` (m, 3).
+        :return: ids (m, k) y distancias (m, k), rellenados con -1 / inf
+        """
+        return _pad([self.knn(q, k) for q in np.asarray(points).reshape(-1, 3)], k)
+
+    def query_radius_batch(self, points, r, sort=False):
+        """
+        ``query_radius`` para cada fila de ``points`` (m, 3).
+        :return: ids y distancias (m, maximo de vecinos), rellenados con -1 / inf
+        """
+        res = [self.query_radius(q, r, sort) for q in np.asarray(points).reshape(-1, 3)]
+        return _pad(res, max((len(i) for i, _ in res), default=0))
+
+    # ------------------------------------------------------------------
+    # regiones
+    # ------------------------------------------------------------------
+    def _query_region(self, classify, test, op, touched=None):
+        """
+        Recorrido comun de ``query_box`` y ``query_frustum``.  ``classify``
+        recibe ids de nodos y devuelve mascaras (dentro, fuera); un nodo
+        completamente dentro aporta todo su subarbol sin probar sus puntos y
+        uno completamente fuera se descarta.  ``test`` filtra los puntos
+        (n, 3) de las hojas que cortan el borde de la region.  ``op`` es el
+        nombre con el que se cuentan los nodos y puntos en ``stats``.
+        En ``touched`` se anotan los nodos de los que depende el resultado:
+        los que aportan todo su subarbol, las hojas probadas y los divididos
+        con algun hijo que falta o esta vacio (ahi puede aparecer un punto
+        nuevo sin pasar por otro nodo visitado).
+        """
+        found = []
+        visited = tested = 0
+        nodes = np.array([0])
+        if touched is not None and not self.count[0]:
+            touched.append(0)
+        while len(nodes):
+            nodes = nodes[self.count[nodes] > 0]
+            visited += len(nodes)
+            inside, outside = classify(nodes)
+            for node in nodes[inside]:
+                found.append(self.subtree_points(node))
+            partial = nodes[~inside & ~outside]
+            leaves = partial[~self.divided[partial]]
+            for node in leaves:
+                ids = np.array(self.node_points(node), dtype=np.int64)
+                tested += len(ids)
+                found.append(ids[test(self.coords[ids])])
+            split = partial[self.divided[partial]]
+            ch = self.children[split]
+            if touched is not None:
+                full = (ch != -1) & (self.count[ch] > 0)
+                touched.extend(nodes[inside].tolist() + leaves.tolist() +
+                               split[full.sum(axis=1) < 8].tolist())
+            ch = ch.ravel()
+            nodes = ch[ch != -1]
+        if self.stats is not None:
+            self.stats.add_query(op, visited, tested)
+        return np.concatenate(found) if found else np.empty(0, np.int64)
+
+    @timed("query_box")
+    def query_box(self, lo, hi, touched=None):
+        """
+        Ids de los puntos dentro de la caja cerrada ``[lo, hi]``.
+        :param touched: como en ``knn``
+        """
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+
+        def classify(nodes):
+            nlo = self.node_min[nodes]
+            nhi = self.node_max[nodes]
+            inside = np.all((nlo >= lo) & (nhi <= hi), axis=1)
+            outside = np.any((nhi < lo) | (nlo > hi), axis=1)
+            return inside, outside
+
+        return self._query_region(
+            classify, lambda xyz: np.all((xyz >= lo) & (xyz <= hi), axis=1), "query_box",
+            touched)
+
+    @timed("query_frustum")
+    def query_frustum(self, planes, touched=None):
+        """
+        Ids de los puntos dentro de un volumen convexo dado por planos
+        (k, 4) ``(a, b, c, d)``, con el interior en ``a*x + b*y + c*z + d >= 0``
+        (por ejemplo los seis planos del frustum de la camara).
+        :param touched: como en ``knn``
+        """
+        planes = np.asarray(planes, dtype=np.float64).reshape(-1, 4)
+        normal = planes[:, :3]
+        offset = planes[:, 3]
+        positive = normal >= 0
+
+        def classify(nodes):
+            nlo = self.node_min[nodes][:, None, :]
+            nhi = self.node_max[nodes][:, None, :]
+            # vertices de la caja mas y menos adentro de cada plano
+            p_vertex = np.where(positive, nhi, nlo)
+            n_vertex = np.where(positive, nlo, nhi)
+            far = np.einsum("nkj,kj->nk", p_vertex, normal) + offset
+            near = np.einsum("nkj,kj->nk", n_vertex, normal) + offset
+            return np.all(near >= 0, axis=1), np.any(far < 0, axis=1)
+
+        return self._query_region(
+            classify, lambda xyz: np.all(xyz @ normal.T + offset >= 0, axis=1),
+            "query_frustum", touched)
+
+    @timed("raycast")
+    def raycast(self, origin, direction, radius=0.1, max_dist=np.inf):
+        """
+        Primer punto a distancia <= ``radius`` del rayo, util para seleccionar
+        con el mouse.  Los nodos se visitan en orden de entrada del rayo a su
+        caja (agrandada en ``radius``) y se corta cuando ya no pueden dar un
+        impacto mas cercano.
+        :return: (id, distancia a lo largo del rayo) o None
+        """
+        o = np.asarray(origin, dtype=np.float64)
+        d = np.asarray(direction, dtype=np.float64)
+        d = d / np.linalg.norm(d)
+        with np.errstate(divide="ignore"):
+            inv = 1.0 / d
+
+        def enter(nodes):
+            with np.errstate(invalid="ignore"):
+                t1 = (self.node_min[nodes] - radius - o) * inv
+                t2 = (self.node_max[nodes] + radius - o) * inv
+            # eje paralelo al rayo: dentro de la losa si el origen lo esta
+            t1 = np.where(np.isnan(t1), -np.inf, t1)
+            t2 = np.where(np.isnan(t2), np.inf, t2)
+            tmin = np.max(np.minimum(t1, t2), axis=1)
+            tmax = np.min(np.maximum(t1, t2), axis=1)
+            hit = (tmax >= np.maximum(tmin, 0)) & (tmin <= max_dist)
+            return nodes[hit], np.maximum(tmin[hit], 0)
+
+        best = None
+        best_t = max_dist
+        heap = [(float(t), int(n)) for n, t in zip(*enter(np.array([0])))]
+        visited = tested = 0
+        while heap:
+            t, node = heapq.heappop(heap)
+            if t > best_t:
+                break
+            visited += 1
+            if self.divided[node]:
+                ch = self.children[node]
+                ch = ch[(ch != -1)]
+                for child, ct in zip(*enter(ch[self.count[ch] > 0])):
+                    heapq.heappush(heap, (float(ct), int(child)))
+                continue
+            ids = np.array(self.node_points(node), dtype=np.int64)
+            tested += len(ids)
+            v = self.coords[ids] - o
+            along = v @ d
+            off2 = np.einsum("ij,ij->i", v, v) - along ** 2
+            ok = (along >= 0) & (off2 <= radius * radius) & (along <= best_t)
+            if ok.any():
+                i = np.argmin(np.where(ok, along, np.inf))
+                best, best_t = int(ids[i]), float(along[i])
+        if self.stats is not None:
+            self.stats.add_query("raycast", visited, tested)
+        return None if best is None else (best, best_t)
+
+    # ------------------------------------------------------------------
+    # consultas en lote
+    # ------------------------------------------------------------------
+    def query_batch(self, kind, queries, k=1, r=0.0, tolerance=1e-6, workers=None,
+                    chunk=1024, processes=True, path=None):
+        """
+        Muchas consultas del mismo tipo repartidas en bloques de ``chunk``
+        entre los procesos (o hilos) de un pool; el arbol solo se lee.  Con
+        un solo bloque o un solo worker se resuelven aca mismo.
+        :param kind: "point" (``find``), "knn", "radius" (ordenado por
+            distancia) o "box"
+        :param queries: puntos (m, 3), o (m, 2, 3) con (lo, hi) para "box"
+        :param workers: tamano del pool (por defecto ``os.cpu_count()``)
+        :param processes: usar procesos.  Cada uno abre el arbol mapeado de
+            ``path`` (un archivo de ``save`` con el estado actual); sin
+            ``path`` se guarda en un archivo temporal que se borra al
+            terminar.  Con hilos las consultas en Python no sueltan el GIL:
+            solo se gana algo en "box", donde el trabajo lo hace NumPy
+        :return: (ids, dist, offsets): los resultados de la consulta ``i``
+            son ``ids[offsets[i]:offsets[i + 1]]``; ``dist`` tiene las
+            distancias para "knn" y "radius" y es None para el resto
+        """
+        if kind not in ("point", "knn", "radius", "box"):
+            raise ValueError(f"tipo de consulta desconocido: {kind!r}")
+        shape = (-1, 2, 3) if kind == "box" else (-1, 3)
+        queries = np.asarray(queries, dtype=np.float64).reshape(shape)
+        blocks = [queries[i:i + chunk] for i in range(0, len(queries), chunk)]
+        workers = min(workers or os.cpu_count() or 1, len(blocks))
+        params = (k, r, tolerance)
+        tmp = None
+        if workers <= 1:
+            results = [_run_batch(self, kind, b, *params) for b in blocks]
+        else:
+            if processes:
+                if path is None:
+                    # mapeado del archivo en vez de una copia del arbol por proceso
+                    tmp = tempfile.mkdtemp(prefix="octree-")
+                    path = os.path.join(tmp, "tree.oct")
+                    self.save(path)
+                pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                                           initargs=(path,))
+                run = _run_batch_worker
+            else:
+                pool = ThreadPoolExecutor(workers)
+
+                def run(*args):
+                    return _run_batch(self, *args)
+            try:
+                with pool:
+                    results = list(pool.map(run, *zip(*[(kind, b) + params for b in blocks])))
+            finally:
+                if tmp is not None:
+                    shutil.rmtree(tmp, ignore_errors=True)
+
+        counts = np.concatenate([c for _, _, c in results]) if results else np.empty(0, np.int64)
+        offsets = np.zeros(len(counts) + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        ids = (np.concatenate([i for i, _, _ in results]) if results
+               else np.empty(0, np.int64))
+        dist = None
+        if kind in ("knn", "radius"):
+            dist = (np.concatenate([d for _, d, _ in results]) if results
+                    else np.empty(0))
+        return ids, dist, offsets
+
+    # ------------------------------------------------------------------
+    # agregados y nivel de detalle
+    # ------------------------------------------------------------------
+    def centroid(self, nodes):
+        """Centroide de los puntos bajo cada nodo de ``nodes``."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.total[nodes] / self.count[nodes][..., None]
+
+    def refresh_boxes(self, node=0):
+        """Recalcula exactas las cajas ``box_min``/``box_max`` bajo ``node``."""
+        order = []
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            order.append(n)
+            if self.divided[n]:
+                stack.extend(c for c in self.children[n] if c != -1)
+        for n in reversed(order):
+            if self.divided[n]:
+                ch = self.children[n]
+                pts_min = self.box_min[ch[ch != -1]]
+                pts_max = self.box_max[ch[ch != -1]]
+            else:
+                pts_min = pts_max = self.coords[self.node_points(n)]
+            self.box_min[n] = pts_min.min(axis=0) if len(pts_min) else np.inf
+            self.box_max[n] = pts_max.max(axis=0) if len(pts_max) else -np.inf
+        if self.observers:
+            self._notify("boxes", np.array(order, np.int64))
+
+    @timed("lod_cut")
+    def lod_cut(self, eye, min_size):
+        """
+        Corte del arbol para dibujar con nivel de detalle.  Se baja desde la
+        raiz mientras el tamano aparente de un nodo (diagonal de la caja de
+        sus puntos dividida por su distancia a ``eye``) sea mayor que
+        ``min_size``, asi la cantidad de nodos depende de la resolucion de la
+        pantalla y no de la cantidad de puntos.
+        :param eye: posicion de la camara
+        :param min_size: tamano aparente minimo, por ejemplo pixeles / foco en pixeles
+        :return: (coarse, leaves): nodos que se dibujan resumidos (centroide
+            y caja) y hojas que se dibujan con todos sus puntos
+        """
+        eye = np.asarray(eye, dtype=np.float64)
+        coarse = []
+        leaves = []
+        nodes = np.array([0])
+        while len(nodes):
+            nodes = nodes[self.count[nodes] > 0]
+            lo = self.box_min[nodes]
+            hi = self.box_max[nodes]
+            d = np.maximum(lo - eye, 0) + np.maximum(eye - hi, 0)
+            size = np.linalg.norm(hi - lo, axis=1)
+            small = size <= min_size * np.linalg.norm(d, axis=1)
+            divided = self.divided[nodes]
+            coarse.append(nodes[small])
+            leaves.append(nodes[~small & ~divided])
+            ch = self.children[nodes[~small & divided]].ravel()
+            nodes = ch[ch != -1]
+        return np.concatenate(coarse), np.concatenate(leaves)
+
+    # ------------------------------------------------------------------
+    # archivo
+    # ------------------------------------------------------------------
+    def save(self, path):
+        """
+        Guarda el arbol en un archivo binario: ``MAGIC``, el largo de una
+        cabecera JSON (parametros y ubicacion de cada arreglo) y despues los
+        arreglos de nodos y puntos tal como estan en memoria, alineados a
+        ``_ALIGN`` bytes, para que ``open`` pueda mapearlos sin copiar.
+        """
+        arrays = [(name, getattr(self, name)[:self.n_nodes])
+                  for name, *_ in self._node_fields()]
+        arrays += [(name, getattr(self, name)[:self.n_points])
+                   for name, *_ in self._point_fields()]
+        arrays += [("free_nodes", np.array(self._free_nodes, np.int64)),
+                   ("free_points", np.array(self._free_points, np.int64))]
+        header, start, meta = file_header(self.file_meta(),
+                                          [(n, a.dtype, a.shape) for n, a in arrays])
+        with open(path, "wb") as f:
+            f.write(header)
+            for name, arr in arrays:
+                f.seek(start + meta["arrays"][name][2])
+                np.ascontiguousarray(arr).tofile(f)
+
+    def file_meta(self):
+        """Parametros del arbol que van en la cabecera del archivo."""
+        return {
+            "capacity": self.capacity,
+            "max_depth": self.max_depth,
+            "min_node_size": self.min_node_size,
+            "dtype": self.dtype.str,
+            "n_nodes": self.n_nodes,
+            "n_points": self.n_points,
+        }
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        """
+        Carga un arbol guardado con ``save``.
+        :param mmap: mapear los arreglos del archivo en vez de leerlos; se
+            abren en modo copia-al-escribir, asi que las consultas leen
+            directo del archivo y los cambios quedan solo en memoria
+        """
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} no es un octree guardado con save()")
+            size = int(np.frombuffer(f.read(8), np.uint64)[0])
+            meta = json.loads(f.read(size))
+        start = -(-(len(MAGIC) + 8 + size) // _ALIGN) * _ALIGN
+
+        tree = cls(0, 0, 0, 1, 1, 1, capacity=meta["capacity"], dtype=meta["dtype"],
+                   max_depth=meta["max_depth"], min_node_size=meta["min_node_size"])
+        arrays = {}
+        for name, (dtype, shape, offset) in meta["arrays"].items():
+            shape = tuple(shape)
+            if not np.prod(shape):
+                arrays[name] = np.empty(shape, dtype)
+            elif mmap:
+                arrays[name] = np.memmap(path, dtype, "c", start + offset, shape)
+            else:
+                arrays[name] = np.fromfile(path, dtype, int(np.prod(shape)),
+                                           offset=start + offset).reshape(shape)
+        tree._free_nodes = arrays.pop("free_nodes").tolist()
+        tree._free_points = arrays.pop("free_points").tolist()
+        for name, arr in arrays.items():
+            setattr(tree, name, arr)
+        tree.n_nodes = meta["n_nodes"]
+        tree.n_points = meta["n_points"]
+        return tree
+
+    # ------------------------------------------------------------------
+    # recorrido
+    # ------------------------------------------------------------------
+    def node_points(self, node):
+        """Ids de los puntos guardados directamente en ``node``."""
+        ids = []
+        p = self.head[node]
+        while p != -1:
+            ids.append(p)
+            p = self.next[p]
+        return ids
+
+    def subtree_points(self, node):
+        """Ids de todos los puntos bajo ``node``."""
+        ids = [p for leaf in self.leaves(node) for p in self.node_points(leaf)]
+        return np.array(ids, dtype=np.int64)
+
+    def dump(self, node=0):
+        """
+        Genera una linea por nodo bajo ``node`` (profundidad, cantidad de
+        puntos y limites) y los puntos de cada hoja; nada se recorre hasta
+        que se piden las lineas.
+        """
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            indent = " " * (4 * int(self.depth[n] - self.depth[node]))
+            lo = ", ".join(f"{v:g}" for v in self.node_min[n])
+            hi = ", ".join(f"{v:g}" for v in self.node_max[n])
+            yield f"{indent}Nivel {self.depth[n]}: {self.count[n]} puntos en ({lo}) a ({hi})"
+            if self.divided[n]:
+                stack.extend(c for c in self.children[n][::-1] if c != -1)
+            elif self.head[n] != -1:
+                pts = ", ".join(str(tuple(self.coords[p].tolist())) for p in self.node_points(n))
+                yield f"{indent}Puntos: {pts}"
+
+    def leaves(self, node=0):
+        """Genera los ids de las hojas bajo ``node``."""
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if self.divided[n]:
+                stack.extend(c for c in self.children[n][::-1] if c != -1)
+            else:
+                yield n
+
+    def __len__(self):
+        return int(self.count[0])
+
+    def copy(self, readonly=False, spare=False):
+        """
+        Copia independiente del arbol, sin observadores.
+        :param readonly: marcar los arreglos como de solo lectura; la copia
+            comparte ``stats`` con el original, que cuenta sus consultas
+        :param spare: copiar tambien las filas de sobra de los arreglos
+        """
+        tree = object.__new__(type(self))
+        tree.__dict__.update(self.__dict__, observers=[],
+                             stats=self.stats if readonly else None,
+                             _free_nodes=list(self._free_nodes),
+                             _free_points=list(self._free_points))
+        for fields, n in ((self._node_fields(), self.n_nodes),
+                          (self._point_fields(), self.n_points)):
+            for name, *_ in fields:
+                arr = getattr(self, name)
+                arr = np.array(arr if spare else arr[:n])
+                arr.flags.writeable = not readonly
+                setattr(tree, name, arr)
+        return tree
+
+    def __getstate__(self):
+        # las vistas registradas no viajan a otros procesos
+        return dict(self.__dict__, observers=[])
@@ -0,0 +1,49 @@
+"""
+Registro de las operaciones de los octrees, apagado por defecto.
+
+Todos los modulos usan loggers hijos de "octree" (``get_logger("algo")`` ->
+"octree.algo").  Sin configurar nada solo salen por stderr los WARNING o
+mas graves (el comportamiento por defecto de ``logging``); para activarlo
+se llama a ``enable("DEBUG")`` o se define la variable de entorno
+``OCTREE_LOG`` (por ejemplo ``OCTREE_LOG=TRACE``).
+
+El nivel ``TRACE`` (debajo de DEBUG) agrega volcados del arbol.  Se pasan
+como ``Dump(generador)``: las lineas solo se generan si el mensaje se
+escribe de verdad.
+"""
+import logging
+import os
+import sys
+
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+root = logging.getLogger("octree")
+
+
+def get_logger(name):
+    return root.getChild(name)
+
+
+class Dump:
+    """Volcado perezoso: ``str()`` recien recorre ``lines()``."""
+
+    def __init__(self, lines, *args):
+        self.lines = lines
+        self.args = args
+
+    def __str__(self):
+        return "\n".join(self.lines(*self.args))
+
+
+def enable(level="DEBUG", stream=None):
+    """Escribe los mensajes de nivel ``level`` o mayor en ``stream`` (stderr)."""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.getLevelName(level) if isinstance(level, str) else level)
+    return handler
+
+
+if os.environ.get("OCTREE_LOG"):
+    enable(os.environ["OCTREE_LOG"].upper())
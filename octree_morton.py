@@ -0,0 +1,297 @@
+"""
+Octree lineal basado en codigos de Morton (orden Z).
+
+Cada punto se cuantiza a una celda de 2**21 por eje dentro de los limites del
+arbol y se guarda su codigo de 63 bits en un arreglo ordenado.  Un nodo de
+nivel ``L`` es un prefijo de ``3 * L`` bits del codigo, de modo que sus puntos
+ocupan un tramo contiguo que se encuentra con dos busquedas binarias.
+
+Las celdas son semiabiertas por abajo, ``(lo, hi]``, igual que el ``x <= mid``
+de ``get_child_index``: el octante en el que cae un punto en cada nivel es el
+mismo que en ``octree_core.Octree``.
+"""
+import math
+from itertools import product
+
+import numpy as np
+
+from octree_core import OCTANT
+
+BITS = 21
+MAX_LEVEL = BITS
+_CELLS = 1 << BITS
+# ``find`` revisa celda por celda hasta esta cantidad de celdas
+FIND_CELLS = 64
+# con mas celdas filtra el tramo entre los codigos de las esquinas si tiene
+# a lo sumo estos puntos; si no, recorre como ``query_box``
+FIND_SPAN = 4096
+
+# (corrimiento, mascara) de cada paso de ``_spread``, creados una sola vez:
+# armar los escalares uint64 en cada llamada pesa mas que la cuenta en si
+# cuando se codifican pocos puntos
+_SPREAD = [(np.uint64(shift), np.uint64(mask)) for shift, mask in (
+    (32, 0x1F00000000FFFF),
+    (16, 0x1F0000FF0000FF),
+    (8, 0x100F00F00F00F00F),
+    (4, 0x10C30C30C30C30C3),
+    (2, 0x1249249249249249),
+)]
+_COMPACT = [(np.uint64(shift), np.uint64(mask)) for shift, mask in (
+    (2, 0x10C30C30C30C30C3),
+    (4, 0x100F00F00F00F00F),
+    (8, 0x1F0000FF0000FF),
+    (16, 0x1F00000000FFFF),
+    (32, 0x1FFFFF),
+)]
+_LOW21 = np.uint64(0x1FFFFF)
+_SPREAD_BITS = np.uint64(0x1249249249249249)
+_ONE = np.uint64(1)
+_TWO = np.uint64(2)
+
+
+def _spread(v):
+    """Intercala dos ceros entre cada bit de ``v`` (enteros < 2**21)."""
+    v = v.astype(np.uint64) & _LOW21
+    for shift, mask in _SPREAD:
+        v = (v | v << shift) & mask
+    return v
+
+
+def _compact(v):
+    """Inversa de ``_spread``."""
+    v = v.astype(np.uint64) & _SPREAD_BITS
+    for shift, mask in _COMPACT:
+        v = (v ^ (v >> shift)) & mask
+    return v
+
+
+def _spread_int(v):
+    """``_spread`` para un entero de Python."""
+    v &= 0x1FFFFF
+    v = (v | v << 32) & 0x1F00000000FFFF
+    v = (v | v << 16) & 0x1F0000FF0000FF
+    v = (v | v << 8) & 0x100F00F00F00F00F
+    v = (v | v << 4) & 0x10C30C30C30C30C3
+    v = (v | v << 2) & 0x1249249249249249
+    return v
+
+
+def _code(cx, cy, cz):
+    """Codigo de Morton de una celda, con enteros de Python."""
+    return _spread_int(cx) | _spread_int(cy) << 1 | _spread_int(cz) << 2
+
+
+def _cell(v, lo, hi):
+    """Celda de la coordenada ``v`` en un eje, igual que ``MortonOctree.cells``."""
+    if hi <= lo:
+        # eje sin ancho: todos los puntos estan en la celda 0
+        return 0
+    t = (v - lo) / (hi - lo) * _CELLS
+    return min(max(math.ceil(t) - 1, 0), _CELLS - 1)
+
+
+def interleave(cells):
+    """Codigo de Morton de celdas enteras (n, 3): bit x, luego y, luego z."""
+    cells = np.asarray(cells)
+    return (_spread(cells[:, 0]) |
+            _spread(cells[:, 1]) << _ONE |
+            _spread(cells[:, 2]) << _TWO)
+
+
+def deinterleave(codes):
+    """Celdas enteras (n, 3) a partir de codigos de Morton."""
+    codes = np.asarray(codes, dtype=np.uint64)
+    return np.stack([_compact(codes),
+                     _compact(codes >> _ONE),
+                     _compact(codes >> _TWO)], axis=-1).astype(np.int64)
+
+
+class MortonOctree:
+    """
+    Octree lineal: ``codes`` ordenados y, en el mismo orden, ``coords`` e
+    ``ids`` (id de insercion de cada punto).  Un nodo se identifica por
+    ``(level, prefix)``; la raiz es ``(0, 0)``.
+    """
+
+    def __init__(self, x1, y1, z1, x2, y2, z2, capacity=1, dtype=np.float64):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.boundary_min = np.array([x1, y1, z1], dtype=np.float64)
+        self.boundary_max = np.array([x2, y2, z2], dtype=np.float64)
+        self.codes = np.empty(0, np.uint64)
+        self.coords = np.empty((0, 3), self.dtype)
+        self.ids = np.empty(0, np.int64)
+        self.n_ids = 0
+
+    def __len__(self):
+        return len(self.codes)
+
+    # ------------------------------------------------------------------
+    # codificacion
+    # ------------------------------------------------------------------
+    def inside(self, xyz):
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        return np.all((xyz >= self.boundary_min) & (xyz <= self.boundary_max), axis=1)
+
+    def cells(self, xyz):
+        """
+        Celdas enteras (n, 3) de puntos dentro de los limites.  En un eje sin
+        ancho (nube plana o alineada) todos los puntos caen en la celda 0,
+        como en ``octree_core``, donde ``x > mid`` nunca se cumple.
+        """
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        size = self.boundary_max - self.boundary_min
+        size = np.where(size > 0, size, 1.0)
+        t = (xyz - self.boundary_min) / size * _CELLS
+        return np.clip(np.ceil(t) - 1, 0, _CELLS - 1).astype(np.int64)
+
+    def encode(self, xyz):
+        """Codigos de Morton de puntos (n, 3) dentro de los limites."""
+        return interleave(self.cells(xyz))
+
+    @staticmethod
+    def child_index(code, level):
+        """Octante (numeracion de ``get_child_index``) del codigo en ``level``."""
+        digit = (int(code) >> (3 * (MAX_LEVEL - level - 1))) & 7
+        return OCTANT[digit]
+
+    def node_range(self, level, prefix):
+        """Tramo ``[start, stop)`` de ``codes`` que cae bajo el nodo."""
+        shift = np.uint64(3 * (MAX_LEVEL - level))
+        lo = np.uint64(prefix) << shift
+        hi = np.uint64(prefix + 1) << shift
+        start = int(np.searchsorted(self.codes, lo, "left"))
+        stop = int(np.searchsorted(self.codes, hi, "left"))
+        return start, stop
+
+    def node_bounds(self, level, prefix):
+        cell = deinterleave(np.array([prefix], np.uint64))[0]
+        step = (self.boundary_max - self.boundary_min) / (1 << level)
+        lo = self.boundary_min + cell * step
+        return lo, lo + step
+
+    # ------------------------------------------------------------------
+    # operaciones
+    # ------------------------------------------------------------------
+    def insert(self, x, y, z):
+        return self.insert_many([(x, y, z)])[0] != -1
+
+    def insert_many(self, points):
+        """
+        Inserta puntos (n, 3) manteniendo ``codes`` ordenado.
+        :return: ids de los puntos insertados, -1 para los que quedan fuera
+        """
+        pts = np.asarray(points, dtype=self.dtype).reshape(-1, 3)
+        inside = self.inside(pts)
+        ids = np.full(len(pts), -1, np.int64)
+        k = int(inside.sum())
+        ids[inside] = np.arange(self.n_ids, self.n_ids + k)
+        self.n_ids += k
+
+        new_pts = pts[inside]
+        new_codes = self.encode(new_pts)
+        order = np.argsort(new_codes, kind="stable")
+        new_codes = new_codes[order]
+        pos = np.searchsorted(self.codes, new_codes, "right")
+        self.codes = np.insert(self.codes, pos, new_codes)
+        self.coords = np.insert(self.coords, pos, new_pts[order], axis=0)
+        self.ids = np.insert(self.ids, pos, ids[inside][order])
+        return ids
+
+    @classmethod
+    def from_points(cls, points, capacity=1, bounds=None, dtype=np.float64):
+        pts = np.asarray(points, dtype=dtype).reshape(-1, 3)
+        if bounds is None:
+            bounds = (pts.min(axis=0), pts.max(axis=0))
+        lo, hi = bounds
+        tree = cls(*lo, *hi, capacity=capacity, dtype=dtype)
+        tree.insert_many(pts)
+        return tree
+
+    def find(self, x, y, z, tolerance=1e-6):
+        """
+        Id de un punto guardado a distancia ``tolerance`` (por eje) de
+        (x, y, z), o None.  Se buscan con ``searchsorted`` los tramos de las
+        celdas entre ``q - tolerance`` y ``q + tolerance`` (con una tolerancia
+        chica son una o pocas celdas) y se filtran por distancia.  Si la caja
+        abarca muchas celdas se filtra el tramo entre los codigos de sus
+        esquinas y, si ese tramo es muy largo, se recorre como ``query_box``.
+        """
+        # un solo punto: cuentas con escalares de Python, que en NumPy pesa mas
+        # armar los arreglos que hacer la cuenta
+        bmin = self.boundary_min.tolist()
+        bmax = self.boundary_max.tolist()
+        q = (x, y, z)
+        if any(v + tolerance < a or v - tolerance > b for v, a, b in zip(q, bmin, bmax)):
+            return None
+        spans = [range(_cell(v - tolerance, a, b), _cell(v + tolerance, a, b) + 1)
+                 for v, a, b in zip(q, bmin, bmax)]
+        if len(spans[0]) * len(spans[1]) * len(spans[2]) <= FIND_CELLS:
+            codes = np.array([_code(*c) for c in product(*spans)], np.uint64)
+            starts = np.searchsorted(self.codes, codes, "left")
+            stops = np.searchsorted(self.codes, codes, "right")
+        else:
+            # el orden Z es monotono por eje: toda la caja cae entre los codigos
+            # de sus dos esquinas, aunque ese tramo puede traer puntos de mas
+            corners = np.array([_code(*(r[0] for r in spans)),
+                                _code(*(r[-1] for r in spans))], np.uint64)
+            starts = np.searchsorted(self.codes, corners[:1], "left")
+            stops = np.searchsorted(self.codes, corners[1:], "right")
+            if stops[0] - starts[0] > FIND_SPAN:
+                qa = np.array(q, dtype=np.float64)
+                ids = self.query_box(qa - tolerance, qa + tolerance)
+                return int(ids[0]) if len(ids) else None
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            if start == stop:
+                continue
+            pts = self.coords[start:stop]
+            hit = np.flatnonzero(np.all(np.abs(pts - q) <= tolerance, axis=1))
+            if len(hit):
+                return int(self.ids[start + hit[0]])
+        return None
+
+    def search(self, x, y, z, tolerance=1e-6):
+        return self.find(x, y, z, tolerance) is not None
+
+    def query_box(self, lo, hi):
+        """Ids de los puntos dentro de la caja cerrada ``[lo, hi]``."""
+        lo = np.asarray(lo, dtype=np.float64)
+        hi = np.asarray(hi, dtype=np.float64)
+        found = []
+        stack = [(0, 0)]
+        while stack:
+            level, prefix = stack.pop()
+            start, stop = self.node_range(level, prefix)
+            if start == stop:
+                continue
+            nlo, nhi = self.node_bounds(level, prefix)
+            if np.any(nhi < lo) or np.any(nlo > hi):
+                continue
+            if np.all(nlo >= lo) and np.all(nhi <= hi):
+                found.append(self.ids[start:stop])
+            elif stop - start <= self.capacity or level == MAX_LEVEL:
+                pts = self.coords[start:stop]
+                keep = np.all((pts >= lo) & (pts <= hi), axis=1)
+                found.append(self.ids[start:stop][keep])
+            else:
+                stack.extend((level + 1, (prefix << 3) | d) for d in range(8))
+        return np.concatenate(found) if found else np.empty(0, np.int64)
+
+    # ------------------------------------------------------------------
+    # recorrido
+    # ------------------------------------------------------------------
+    def leaves(self):
+        """
+        Genera ``(level, prefix)`` de las hojas no vacias: nodos con a lo sumo
+        ``capacity`` puntos cuyo padre tiene mas.
+        """
+        stack = [(0, 0)]
+        while stack:
+            level, prefix = stack.pop()
+            start, stop = self.node_range(level, prefix)
+            if start == stop:
+                continue
+            if stop - start <= self.capacity or level == MAX_LEVEL:
+                yield level, prefix
+            else:
+                stack.extend((level + 1, (prefix << 3) | d) for d in range(7, -1, -1))
@@ -0,0 +1,485 @@
+"""
+Visualizacion en Panda3D de ``octree_core.Octree``.
+
+Las vistas se registran en ``tree.observers`` y solo tocan la geometria de
+los nodos que se dividieron, se fusionaron o cambiaron de puntos desde el
+ultimo ``sync()``, en vez de borrar y volver a dibujar todo el arbol.
+"""
+import math
+
+import numpy as np
+from panda3d.core import (Geom, GeomEnums, GeomLines, GeomNode, GeomPoints, GeomVertexData,
+                          GeomVertexFormat, LColor, OmniBoundingVolume, Shader, Texture)
+
+CUBE_EDGES = ((0, 1), (1, 2), (2, 3), (3, 0),
+              (4, 5), (5, 6), (6, 7), (7, 4),
+              (0, 4), (1, 5), (2, 6), (3, 7))
+
+
+# esquinas de una caja (mismo orden que ``draw_cube`` en test.py): True = maximo
+_CORNER_HI = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0),
+                       (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)], dtype=bool)
+_EDGE_INDEX = np.array(CUBE_EDGES, dtype=np.uint32).ravel()
+
+
+def is_leaf(tree, node):
+    """Si ``node`` es una hoja viva de ``tree`` (no una fila libre)."""
+    return node < tree.n_nodes and tree.depth[node] != -1 and not tree.divided[node]
+
+
+def points_geom(parent, name, color=(1, 1, 1, 1), size=3):
+    """
+    NodePath con un ``GeomPoints`` vacio de indices uint32.
+    :return: (node_path, vdata, prim) para llenar con ``upload_points``
+    """
+    vdata = GeomVertexData(name, GeomVertexFormat.get_v3(), Geom.UH_dynamic)
+    prim = GeomPoints(Geom.UH_dynamic)
+    prim.set_index_type(GeomEnums.NT_uint32)
+    geom = Geom(vdata)
+    geom.add_primitive(prim)
+    node = GeomNode(name)
+    node.add_geom(geom)
+    node.set_bounds(OmniBoundingVolume())
+    node.set_final(True)
+    node_path = parent.attach_new_node(node)
+    node_path.set_render_mode_thickness(size)
+    node_path.set_color(LColor(*color))
+    return node_path, vdata, prim
+
+
+def upload_points(vdata, prim, coords, index):
+    """Reemplaza los vertices (n, 3) y los indices de un ``points_geom``."""
+    coords = np.ascontiguousarray(coords, dtype=np.float32)
+    vdata.unclean_set_num_rows(len(coords))
+    vdata.modify_array_handle(0).copy_data_from(coords)
+    index = np.ascontiguousarray(index, dtype=np.uint32)
+    array = prim.modify_vertices(len(index))
+    array.unclean_set_num_rows(len(index))
+    array.modify_handle().copy_data_from(index)
+    prim.clear_minmax()
+
+
+class BoxLines:
+    """
+    Muchas cajas de alambre en un solo ``GeomLines``: una sola NodePath y
+    una llamada de dibujo en vez de una ``LineSegs`` por caja.
+
+    Cada caja ocupa un "slot" de 8 vertices en un arreglo de NumPy que se
+    copia al ``GeomVertexData``; ``flush()`` sube solo los slots que
+    cambiaron.  Un slot libre se colapsa a un punto y no se ve.
+    """
+
+    def __init__(self, parent, color=(1, 1, 1, 1), thickness=2, slots=256, name="boxes"):
+        self.corners = np.zeros((slots, 8, 3), np.float32)
+        self.used = 0
+        self.free = []
+        self.dirty = set()
+        self.resized = True
+
+        self.vdata = GeomVertexData(name, GeomVertexFormat.get_v3(), Geom.UH_dynamic)
+        self.lines = GeomLines(Geom.UH_dynamic)
+        self.lines.set_index_type(GeomEnums.NT_uint32)
+        geom = Geom(self.vdata)
+        geom.add_primitive(self.lines)
+        node = GeomNode(name)
+        node.add_geom(geom)
+        # las cajas cambian en el lugar; no vale la pena recalcular limites
+        node.set_bounds(OmniBoundingVolume())
+        node.set_final(True)
+        self.node_path = parent.attach_new_node(node)
+        self.node_path.set_render_mode_thickness(thickness)
+        self.node_path.set_color(LColor(*color))
+        self.node_path.set_transparency(True)
+
+    def add(self, lo, hi):
+        """Agrega una caja y devuelve su slot."""
+        slot = self.take()
+        self.set(slot, lo, hi)
+        return slot
+
+    def take(self):
+        """Reserva un slot (primero los liberados); hay que llenarlo con ``set``."""
+        if self.free:
+            return self.free.pop()
+        if self.used == len(self.corners):
+            corners = np.zeros((2 * len(self.corners), 8, 3), np.float32)
+            corners[:self.used] = self.corners[:self.used]
+            self.corners = corners
+            self.resized = True
+        self.used += 1
+        return self.used - 1
+
+    def set(self, slot, lo, hi):
+        self.corners[slot] = np.where(_CORNER_HI, hi, lo)
+        self.dirty.add(slot)
+
+    def set_many(self, slots, lo, hi):
+        """``set`` vectorizado: ``lo``/``hi`` de forma (n, 3)."""
+        self.corners[slots] = np.where(_CORNER_HI, np.asarray(hi)[:, None, :],
+                                       np.asarray(lo)[:, None, :])
+        self.dirty.update(int(s) for s in slots)
+
+    def remove(self, slot):
+        self.corners[slot] = self.corners[slot, 0]
+        self.dirty.add(slot)
+        self.free.append(slot)
+
+    def replace(self, lo, hi):
+        """Cambia todas las cajas por las de ``lo``/``hi`` (n, 3) de una vez."""
+        n = len(lo)
+        if n > len(self.corners) or n < len(self.corners) // 4:
+            self.corners = np.zeros((max(n, 256), 8, 3), np.float32)
+        else:
+            self.corners[n:] = 0
+        self.corners[:n] = np.where(_CORNER_HI, np.asarray(hi)[:, None, :],
+                                    np.asarray(lo)[:, None, :])
+        self.used = n
+        self.free = []
+        self.resized = True
+
+    def flush(self):
+        """Copia a la GPU los slots modificados desde el ultimo ``flush``."""
+        if self.resized:
+            self._upload_all()
+        elif self.dirty:
+            handle = self.vdata.modify_array_handle(0)
+            data = self.corners.reshape(-1)
+            stride = 8 * 3 * 4
+            slots = np.sort(np.fromiter(self.dirty, np.int64))
+            # tramos de slots consecutivos en una sola copia cada uno
+            breaks = np.flatnonzero(np.diff(slots) != 1) + 1
+            for run in np.split(slots, breaks):
+                start, size = run[0] * stride, len(run) * stride
+                handle.copy_subdata_from(start, size, data, start, size)
+        self.dirty.clear()
+
+    def _upload_all(self):
+        self.vdata.unclean_set_num_rows(8 * len(self.corners))
+        self.vdata.modify_array_handle(0).copy_data_from(self.corners.reshape(-1))
+        # indices para toda la capacidad: los slots sin usar son cajas de tamano 0
+        index = (np.arange(len(self.corners), dtype=np.uint32)[:, None] * 8 +
+                 _EDGE_INDEX).ravel()
+        array = self.lines.modify_vertices(len(index))
+        array.unclean_set_num_rows(len(index))
+        array.modify_handle().copy_data_from(index)
+        self.lines.clear_minmax()
+        self.resized = False
+
+    def destroy(self):
+        self.node_path.remove_node()
+
+
+class OctreeWireframe:
+    """
+    Alambre de todas las hojas de un ``octree_core.Octree`` en un ``BoxLines``
+    que se actualiza en el lugar a medida que el arbol cambia.
+    """
+
+    def __init__(self, tree, parent, color=(1, 1, 1, 1), thickness=2):
+        self.tree = tree
+        self.boxes = BoxLines(parent, color, thickness, name="octree-wireframe")
+        self.slot_of = {}
+        self.touched = set(tree.leaves())
+        tree.observers.append(self.on_change)
+        self.sync()
+
+    def on_change(self, event, nodes):
+        self.touched.update(int(n) for n in nodes)
+
+    def sync(self):
+        tree = self.tree
+        leaves = []
+        for node in self.touched:
+            slot = self.slot_of.get(node)
+            if is_leaf(tree, node):
+                if slot is None:
+                    self.slot_of[node] = self.boxes.take()
+                leaves.append(node)
+            elif slot is not None:
+                self.boxes.remove(self.slot_of.pop(node))
+        self.touched.clear()
+        if leaves:
+            slots = np.array([self.slot_of[n] for n in leaves])
+            self.boxes.set_many(slots, tree.node_min[leaves], tree.node_max[leaves])
+        self.boxes.flush()
+
+    def destroy(self):
+        self.tree.observers.remove(self.on_change)
+        self.boxes.destroy()
+
+
+class SphereNodes:
+    """
+    Una NodePath por punto con el modelo de esfera.  Sirve para pocos
+    puntos; ``sync()`` solo crea, mueve o borra las esferas de las hojas que
+    cambiaron.
+    """
+
+    def __init__(self, tree, parent, loader, model="models/misc/sphere", scale=0.2,
+                 color=(1, 1, 1, 1)):
+        self.tree = tree
+        self.parent = parent
+        self.loader = loader
+        self.model = model
+        self.scale = scale
+        self.color = color
+        self.spheres = {}      # id de punto -> NodePath
+        self.leaf_points = {}  # hoja -> ids dibujados
+        self.touched = set(tree.leaves())
+        tree.observers.append(self.on_change)
+        self.sync()
+
+    def on_change(self, event, nodes):
+        self.touched.update(int(n) for n in nodes)
+
+    def sync(self):
+        tree = self.tree
+        added = set()
+        removed = set()
+        kept = set()
+        for node in self.touched:
+            old = self.leaf_points.pop(node, set())
+            if is_leaf(tree, node):
+                new = set(tree.node_points(node))
+                self.leaf_points[node] = new
+            else:
+                new = set()
+            added |= new - old
+            removed |= old - new
+            kept |= new & old
+        self.touched.clear()
+
+        # un punto que paso de una hoja a otra conserva su esfera
+        for p in removed - added:
+            self.spheres.pop(p).remove_node()
+        for p in added - removed:
+            self.spheres[p] = self.make_sphere(p)
+        for p in kept | (added & removed):
+            self.spheres[p].set_pos(*tree.coords[p])
+
+    def make_sphere(self, p):
+        sphere = self.loader.load_model(self.model)
+        sphere.set_scale(self.scale)
+        sphere.set_pos(*self.tree.coords[p])
+        sphere.set_color(LColor(*self.color))
+        sphere.reparent_to(self.parent)
+        return sphere
+
+    def destroy(self):
+        self.tree.observers.remove(self.on_change)
+        for sphere in self.spheres.values():
+            sphere.remove_node()
+        self.spheres.clear()
+
+
+class PointCloud:
+    """
+    Todos los puntos del octree en un solo ``GeomPoints``.  El buffer de
+    vertices es una copia directa de ``tree.coords`` y el de indices lista
+    los ids vivos, asi que no hay un nodo de escena por punto.
+    """
+
+    def __init__(self, tree, parent, color=(1, 1, 1, 1), size=3):
+        self.tree = tree
+        self.node_path, self.vdata, self.prim = points_geom(parent, "octree-points", color, size)
+        self.dirty = True
+        tree.observers.append(self.on_change)
+        self.sync()
+
+    def on_change(self, event, nodes):
+        if event == "points":
+            self.dirty = True
+
+    def sync(self):
+        if not self.dirty:
+            return
+        tree = self.tree
+        n = tree.n_points
+        upload_points(self.vdata, self.prim, tree.coords[:n],
+                      np.flatnonzero(tree.leaf[:n] != -1))
+        self.dirty = False
+
+    def destroy(self):
+        self.tree.observers.remove(self.on_change)
+        self.node_path.remove_node()
+
+
+_INSTANCE_VERT = """
+#version 150
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform samplerBuffer positions;
+uniform float radius;
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+out vec3 normal;
+void main() {
+    // xyz: centro del punto, w: 1 si el id esta vivo, 0 si la fila esta libre
+    vec4 center = texelFetch(positions, gl_InstanceID);
+    vec3 pos = p3d_Vertex.xyz * radius * center.w + center.xyz;
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(pos, 1.0);
+    normal = p3d_Normal;
+}
+"""
+
+_INSTANCE_FRAG = """
+#version 150
+uniform vec4 color;
+in vec3 normal;
+out vec4 p3d_FragColor;
+void main() {
+    float light = 0.35 + 0.65 * max(dot(normalize(normal), normalize(vec3(0.4, -0.6, 0.7))), 0.0);
+    p3d_FragColor = vec4(color.rgb * light, color.a);
+}
+"""
+
+
+class InstancedSpheres:
+    """
+    Esferas con instanciado por hardware: un solo modelo cargado una vez y
+    ``set_instance_count`` igual al numero de filas de puntos.  Los centros
+    se leen en el shader desde una textura buffer llenada con ``tree.coords``.
+    """
+
+    def __init__(self, tree, parent, loader, model="models/misc/sphere", radius=0.2,
+                 color=(1, 1, 1, 1)):
+        self.tree = tree
+        self.positions = Texture("octree-positions")
+        self.model = loader.load_model(model)
+        self.model.reparent_to(parent)
+        self.model.set_shader(Shader.make(Shader.SL_GLSL, _INSTANCE_VERT, _INSTANCE_FRAG))
+        self.model.set_shader_input("positions", self.positions)
+        self.model.set_shader_input("radius", radius)
+        self.model.set_shader_input("color", LColor(*color))
+        # las instancias se mueven en el shader; los limites del modelo no sirven
+        self.model.node().set_bounds(OmniBoundingVolume())
+        self.model.node().set_final(True)
+        self.dirty = True
+        tree.observers.append(self.on_change)
+        self.sync()
+
+    def on_change(self, event, nodes):
+        if event == "points":
+            self.dirty = True
+
+    def sync(self):
+        if not self.dirty:
+            return
+        tree = self.tree
+        n = tree.n_points
+        centers = np.zeros((max(n, 1), 4), np.float32)
+        centers[:n, :3] = tree.coords[:n]
+        centers[:n, 3] = tree.leaf[:n] != -1
+        self.positions.setup_buffer_texture(len(centers), Texture.T_float, Texture.F_rgba32,
+                                            GeomEnums.UH_dynamic)
+        self.positions.set_ram_image(centers)
+        # con 0 instancias Panda3D dibujaria el modelo una vez sin instanciar
+        if n:
+            self.model.set_instance_count(n)
+            self.model.show()
+        else:
+            self.model.hide()
+        self.dirty = False
+
+    def destroy(self):
+        self.tree.observers.remove(self.on_change)
+        self.model.remove_node()
+
+
+class LodView:
+    """
+    Vista con nivel de detalle segun la camara (``tree.lod_cut``): los nodos
+    que en pantalla miden menos de ``pixels`` se dibujan como un punto en su
+    centroide y la caja de sus puntos; solo las hojas cercanas se dibujan
+    con todos sus puntos.  El costo depende de la resolucion, no del
+    tamano del arbol.
+
+    :param camera: NodePath de la camara (``base.camera``)
+    :param lens: lente de la camara (``base.camLens``), para el campo visual
+    :param height: alto de la ventana en pixeles
+    """
+
+    def __init__(self, tree, parent, camera, lens, height=600, pixels=4,
+                 point_color=(1, 1, 1, 1), box_color=(0.5, 0.5, 1, 1), size=3):
+        self.tree = tree
+        self.parent = parent
+        self.camera = camera
+        self.lens = lens
+        self.height = height
+        self.pixels = pixels
+        self.node_path, self.vdata, self.prim = points_geom(parent, "octree-lod", point_color, size)
+        self.boxes = BoxLines(parent, box_color, thickness=1, name="octree-lod-boxes")
+        self.eye = None
+        self.dirty = True
+        tree.observers.append(self.on_change)
+        self.sync()
+
+    def on_change(self, event, nodes):
+        self.dirty = True
+
+    def min_size(self):
+        """Tamano aparente (lado / distancia) que ocupa ``pixels`` en pantalla."""
+        fov = math.radians(self.lens.get_fov()[1])
+        focal = self.height / (2 * math.tan(fov / 2))
+        return self.pixels / focal
+
+    def sync(self):
+        """Recalcula el corte si la camara se movio o el arbol cambio."""
+        eye = tuple(self.camera.get_pos(self.parent))
+        if not self.dirty and eye == self.eye:
+            return
+        self.eye = eye
+        self.dirty = False
+        tree = self.tree
+        coarse, leaves = tree.lod_cut(eye, self.min_size())
+        ids = [p for leaf in leaves for p in tree.node_points(leaf)]
+        coords = np.concatenate([tree.centroid(coarse), tree.coords[ids]])
+        upload_points(self.vdata, self.prim, coords, np.arange(len(coords)))
+        self.boxes.replace(tree.box_min[coarse], tree.box_max[coarse])
+        self.boxes.flush()
+
+    def destroy(self):
+        self.tree.observers.remove(self.on_change)
+        self.node_path.remove_node()
+        self.boxes.destroy()
+
+
+class OctreeView:
+    """
+    Dibuja las hojas del octree como cubos de alambre (un solo
+    ``OctreeWireframe``) y sus puntos, y los mantiene al dia de forma
+    incremental.
+
+    :param tree: ``octree_core.Octree``
+    :param parent: NodePath donde se cuelga la escena (por ejemplo ``render``)
+    :param loader: ``ShowBase.loader`` para cargar el modelo de las esferas
+    :param point_mode: "spheres" (una NodePath por punto), "points" (un solo
+        ``GeomPoints``) o "instanced" (esferas con instanciado por hardware)
+    """
+
+    def __init__(self, tree, parent, loader, point_mode="spheres", point_scale=0.2,
+                 cube_color=(1, 1, 1, 1), point_color=(1, 1, 1, 1),
+                 sphere_model="models/misc/sphere"):
+        self.tree = tree
+        self.root = parent.attach_new_node("octree")
+        self.root.set_tag("octree", "true")
+        self.wireframe = OctreeWireframe(tree, self.root, cube_color)
+        if point_mode == "points":
+            self.points = PointCloud(tree, self.root, point_color)
+        elif point_mode == "instanced":
+            self.points = InstancedSpheres(tree, self.root, loader, sphere_model,
+                                           point_scale, point_color)
+        elif point_mode == "spheres":
+            self.points = SphereNodes(tree, self.root, loader, sphere_model,
+                                      point_scale, point_color)
+        else:
+            raise ValueError(f"point_mode desconocido: {point_mode!r}")
+
+    def sync(self):
+        """Aplica a la escena los cambios acumulados desde el ultimo ``sync``."""
+        self.points.sync()
+        self.wireframe.sync()
+
+    def destroy(self):
+        self.points.destroy()
+        self.wireframe.destroy()
+        self.root.remove_node()
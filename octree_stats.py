@@ -0,0 +1,136 @@
+"""
+Estadisticas opcionales de ``octree_core.Octree``.
+
+Con ``tree.enable_stats()`` el arbol acumula, por operacion, llamadas,
+tiempo total, nodos visitados y puntos probados, y cuenta eventos como
+divisiones y colapsos.  Los histogramas de profundidad de las hojas y de
+puntos por hoja se calculan recien al exportar (``as_dict`` o
+``to_prometheus``).  Con ``tree.stats`` en None, que es lo normal, cada
+operacion solo paga una comparacion.
+"""
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+import numpy as np
+
+
+def timed(op):
+    """Decorador de metodos del arbol: suma el tiempo a ``op`` si hay estadisticas."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.stats is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stats.add_time(op, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class OperationStats:
+    __slots__ = ("calls", "seconds", "nodes_visited", "points_tested", "max_nodes_visited")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.nodes_visited = 0
+        self.points_tested = 0
+        self.max_nodes_visited = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class OctreeStats:
+    """
+    Contadores de un arbol.  ``ops`` mapea el nombre de la operacion a su
+    ``OperationStats``; ``events`` cuenta "subdivide", "collapse", etc.  El
+    tiempo de una operacion incluye el de las que llama (``delete`` llama
+    a ``find``).
+    """
+
+    def __init__(self):
+        self.ops = defaultdict(OperationStats)
+        self.events = Counter()
+
+    def reset(self):
+        self.ops.clear()
+        self.events.clear()
+
+    def add_time(self, op, seconds):
+        stats = self.ops[op]
+        stats.calls += 1
+        stats.seconds += seconds
+
+    def add_query(self, op, visited, tested):
+        stats = self.ops[op]
+        stats.nodes_visited += visited
+        stats.points_tested += tested
+        stats.max_nodes_visited = max(stats.max_nodes_visited, visited)
+
+    def add_event(self, name, k=1):
+        self.events[name] += k
+
+    @staticmethod
+    def histograms(tree):
+        """
+        Histogramas del estado actual: ``depth[d]`` hojas a profundidad ``d`` y
+        ``occupancy[k]`` hojas con ``k`` puntos.
+        """
+        n = tree.n_nodes
+        leaf = (tree.depth[:n] != -1) & ~tree.divided[:n]
+        return {
+            "depth": np.bincount(tree.depth[:n][leaf]).tolist(),
+            "occupancy": np.bincount(tree.count[:n][leaf]).tolist(),
+        }
+
+    def as_dict(self, tree=None):
+        """Todo en un dict; con ``tree`` agrega nodos, puntos e histogramas."""
+        out = {
+            "ops": {op: s.as_dict() for op, s in self.ops.items()},
+            "events": dict(self.events),
+        }
+        if tree is not None:
+            live = tree.depth[:tree.n_nodes] != -1
+            out["nodes"] = int(live.sum())
+            out["points"] = len(tree)
+            out["max_depth"] = int(tree.depth[:tree.n_nodes].max())
+            out.update(self.histograms(tree))
+        return out
+
+    def to_prometheus(self, tree=None, prefix="octree"):
+        """Las mismas cifras en el formato de texto de Prometheus."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{prefix}_{name}{{{label}}} {value}" if label
+                             else f"{prefix}_{name} {value}")
+
+        ops = sorted(self.ops.items())
+        metric("op_calls_total", "counter", "Llamadas por operacion",
+               [({"op": op}, s.calls) for op, s in ops])
+        metric("op_seconds_total", "counter", "Tiempo acumulado por operacion",
+               [({"op": op}, s.seconds) for op, s in ops])
+        metric("nodes_visited_total", "counter", "Nodos visitados por las consultas",
+               [({"op": op}, s.nodes_visited) for op, s in ops])
+        metric("points_tested_total", "counter", "Puntos comparados por las consultas",
+               [({"op": op}, s.points_tested) for op, s in ops])
+        metric("events_total", "counter", "Divisiones, colapsos y otros eventos",
+               [({"event": e}, k) for e, k in sorted(self.events.items())])
+        if tree is not None:
+            data = self.as_dict(tree)
+            metric("nodes", "gauge", "Nodos en uso", [({}, data["nodes"])])
+            metric("points", "gauge", "Puntos guardados", [({}, data["points"])])
+            metric("leaves_by_depth", "gauge", "Hojas por profundidad",
+                   [({"depth": d}, k) for d, k in enumerate(data["depth"]) if k])
+            metric("leaves_by_occupancy", "gauge", "Hojas por cantidad de puntos",
+                   [({"points": c}, k) for c, k in enumerate(data["occupancy"]) if k])
+        return "\n".join(lines) + "\n"
@@ -3,117 +3,12 @@ from panda3d.core import LVecBase3, LColor, LineSegs, TextNode
 from direct.gui.DirectGui import DirectButton, DirectEntry, DirectDialog
 import random
 
-sphere_dict = {}
-class Point:
-    def __init__(self, x=-1, y=-1, z=-1):
-        self.x = x
-        self.y = y
-        self.z = z
-    def __eq__(self, other):
-        if isinstance(other, Point):
-            tolerance = 1e-6  
-            return (abs(self.x - other.x) < tolerance and
-                    abs(self.y - other.y) < tolerance and
-                    abs(self.z - other.z) < tolerance)
-        return False
+from octree_adaptive import Tuner
+from octree_core import Octree
+from octree_log import get_logger
+from octree_render import LodView, OctreeView
 
-class Octree:
-    def __init__(self, x1, y1, z1, x2, y2, z2, capacity=1):
-        self.capacity = capacity
-        self.boundary_min = Point(x1, y1, z1)
-        self.boundary_max = Point(x2, y2, z2)
-        self.points = []
-        self.children = [None] * 8
-        self.divided = False
-        
-    def subdivide(self):
-        midx = (self.boundary_min.x + self.boundary_max.x) / 2
-        midy = (self.boundary_min.y + self.boundary_max.y) / 2
-        midz = (self.boundary_min.z + self.boundary_max.z) / 2
-        boundaries = [
-            (self.boundary_min.x, self.boundary_min.y, self.boundary_min.z, midx, midy, midz),  
-            (midx, self.boundary_min.y, self.boundary_min.z, self.boundary_max.x, midy, midz),  
-            (midx, midy, self.boundary_min.z, self.boundary_max.x, self.boundary_max.y, midz),  
-            (self.boundary_min.x, midy, self.boundary_min.z, midx, self.boundary_max.y, midz),  
-            (self.boundary_min.x, self.boundary_min.y, midz, midx, midy, self.boundary_max.z),  
-            (midx, self.boundary_min.y, midz, self.boundary_max.x, midy, self.boundary_max.z),  
-            (midx, midy, midz, self.boundary_max.x, self.boundary_max.y, self.boundary_max.z),  
-            (self.boundary_min.x, midy, midz, midx, self.boundary_max.y, self.boundary_max.z),  
-        ]
-        for i in range(8):
-            self.children[i] = Octree(*boundaries[i], self.capacity)
-        self.divided = True
-
-    def insert(self, x, y, z):
-        if not (self.boundary_min.x <= x <= self.boundary_max.x and
-                self.boundary_min.y <= y <= self.boundary_max.y and
-                self.boundary_min.z <= z <= self.boundary_max.z):
-            return False
-
-        if not self.divided and len(self.points) < self.capacity:
-            self.points.append(Point(x, y, z))
-            return True
-
-        if not self.divided:
-            self.subdivide()
-            for p in self.points:
-                idx = self.get_child_index(p.x, p.y, p.z)
-                self.children[idx].insert(p.x, p.y, p.z)
-            self.points = []  
-
-        idx = self.get_child_index(x, y, z)
-        return self.children[idx].insert(x, y, z)
-
-    def get_child_index(self, x, y, z):
-        midx = (self.boundary_min.x + self.boundary_max.x) / 2
-        midy = (self.boundary_min.y + self.boundary_max.y) / 2
-        midz = (self.boundary_min.z + self.boundary_max.z) / 2
-
-        if x <= midx:
-            if y <= midy:
-                if z <= midz:
-                    return 0  
-                else:
-                    return 4 
-            else:
-                if z <= midz:
-                    return 3 
-                else:
-                    return 7  
-        else:
-            if y <= midy:
-                if z <= midz:
-                    return 1  
-                else:
-                    return 5  
-            else:
-                if z <= midz:
-                    return 2  
-                else:
-                    return 6  
-    
-    def search(self, x, y, z):
-        
-        if not (self.boundary_min.x <= x <= self.boundary_max.x and
-                self.boundary_min.y <= y <= self.boundary_max.y and
-                self.boundary_min.z <= z <= self.boundary_max.z):
-            return False
-
-        
-        for point in self.points:
-            if point.x == x and point.y == y and point.z == z:
-                return True
-
-        
-        if self.divided:
-            for child in self.children:
-                if child and child.search(x, y, z):
-                    return True
-
-        
-        return False
-
-    
+log = get_logger("app")
 
 
 class OctreeApp(ShowBase):
@@ -123,6 +18,9 @@ class OctreeApp(ShowBase):
         self.size = 10
         self.octree = Octree(-self.size / 2, -self.size / 2, -self.size / 2,
                              self.size / 2, self.size / 2, self.size / 2, self.capacity)
+        # ``capacity`` es solo el valor inicial: el tuner la ajusta segun el uso
+        self.tuner = Tuner(self.octree)
+        self.task_mgr.do_method_later(2.0, self.tune, "tune")
 
         self.camera.set_pos(20, 30, 20)
         self.camera.look_at(0, 0, 0)
@@ -133,6 +31,8 @@ class OctreeApp(ShowBase):
 
         
         self.draw_axis_lines()
+
+        self.view = OctreeView(self.octree, self.render, self.loader, point_mode="instanced")
         
         
         self.add_point_button = DirectButton(text="Punto random", scale=0.1, pos=(0, 0, -0.8),
@@ -140,6 +40,31 @@ class OctreeApp(ShowBase):
         
         self.manual_point_button = DirectButton(text="Opera", scale=0.1, pos=(0, 0, -0.6),
                                                 command=self.open_input_dialog)
+
+        self.lod_button = DirectButton(text="LOD", scale=0.1, pos=(0, 0, -0.4),
+                                       command=self.toggle_lod)
+
+    def toggle_lod(self):
+        """Cambia entre dibujar todo el octree y la vista con nivel de detalle."""
+        self.view.destroy()
+        if isinstance(self.view, LodView):
+            self.task_mgr.remove("lod")
+            self.view = OctreeView(self.octree, self.render, self.loader, point_mode="instanced")
+        else:
+            self.view = LodView(self.octree, self.render, self.camera, self.camLens,
+                                self.win.get_y_size())
+            # la vista depende de la camara: se revisa en cada cuadro
+            self.task_mgr.add(self.sync_lod, "lod")
+
+    def sync_lod(self, task):
+        self.view.sync()
+        return task.cont
+
+    def tune(self, task):
+        # en el hilo de la app: la vista comparte el arbol
+        if self.tuner.step()["rebuilt"]:
+            self.view.sync()
+        return task.again
     def draw_axis_lines(self):
         axis_line_segs = LineSegs()
         axis_line_segs.set_thickness(2)
@@ -182,6 +107,9 @@ class OctreeApp(ShowBase):
         
         search_button = DirectButton(parent=self.dialog, text="Search Point", scale=0.07, pos=(0, 0, -0.3),
                                     command=self.search_point)
+
+        delete_button = DirectButton(parent=self.dialog, text="Delete Point", scale=0.07, pos=(0, 0, -0.5),
+                                     command=self.delete_point)
         
         
                                     
@@ -192,7 +120,7 @@ class OctreeApp(ShowBase):
             y = float(self.y_entry.get())
             z = float(self.z_entry.get())
         except ValueError:
-            print("Please enter valid numbers for X, Y, and Z.")
+            log.warning("Please enter valid numbers for X, Y, and Z.")
             return
         
         
@@ -201,14 +129,7 @@ class OctreeApp(ShowBase):
         
         if self.octree.insert(x, y, z):
             print(f"Inserted manual point at ({x:.2f}, {y:.2f}, {z:.2f})")
-            
-
-            for node in self.render.get_children():
-                if node.has_tag("octree"):
-                    node.remove_node()
-            sphere = self.draw_sphere((x, y, z))  
-            sphere_dict[(x, y, z)] = sphere
-            self.visualize_octree()
+            self.view.sync()
             
     def search_point(self):
         
@@ -217,7 +138,7 @@ class OctreeApp(ShowBase):
             y = float(self.y_entry.get())
             z = float(self.z_entry.get())
         except ValueError:
-            print("Please enter valid numbers for X, Y, and Z.")
+            log.warning("Please enter valid numbers for X, Y, and Z.")
             return
         
         
@@ -236,7 +157,7 @@ class OctreeApp(ShowBase):
             y = float(self.y_entry.get())
             z = float(self.z_entry.get())
         except ValueError:
-            print("Please enter valid numbers for X, Y, and Z.")
+            log.warning("Please enter valid numbers for X, Y, and Z.")
             return
 
         
@@ -245,18 +166,8 @@ class OctreeApp(ShowBase):
         
         deleted = self.octree.delete(x, y, z)  
         if deleted:
-            
-            if (x, y, z) in sphere_dict:
-                sphere = sphere_dict.pop((x, y, z))  
-                sphere.remove_node()
             print(f"Deleted point ({x}, {y}, {z})")
-            for node in self.render.get_children():
-                if node.has_tag("octree"):
-                    node.remove_node()
-            print("hola")
-            
-            
-            self.visualize_octree()
+            self.view.sync()
         else:
             print(f"Point ({x}, {y}, {z}) not found for deletion.")
     
@@ -283,42 +194,13 @@ class OctreeApp(ShowBase):
         cube_np.set_transparency(True)
         cube_np.set_tag("octree", "true")  
 
-    def draw_sphere(self, position, color=(1, 1, 1, 1)):
-        sphere = self.loader.load_model("models/misc/sphere")
-        sphere.set_scale(0.2)
-        sphere.set_pos(*position)
-        sphere.set_color(LColor(*color))
-        sphere.reparent_to(self.render)
-        return sphere
-
     def add_random_point(self):
         x = random.uniform(-self.size / 2, self.size / 2)
         y = random.uniform(-self.size / 2, self.size / 2)
         z = random.uniform(-self.size / 2, self.size / 2)
         if self.octree.insert(x, y, z):
-            print(f"Inserted point at ({x:.2f}, {y:.2f}, {z:.2f})")
-            
-
-            
-            for node in self.render.get_children():
-                if node.has_tag("octree"):
-                    node.remove_node()
-
-            
-            self.visualize_octree()
-
-    def visualize_octree(self, node=None):
-        if node is None:
-            node = self.octree
-        if not node.divided:
-            self.draw_cube((node.boundary_min.x, node.boundary_min.y, node.boundary_min.z),
-                           (node.boundary_max.x, node.boundary_max.y, node.boundary_max.z))
-            #print(node.points)
-            for point in node.points:
-                self.draw_sphere((point.x, point.y, point.z))
-        else:
-            for child in node.children:
-                self.visualize_octree(child)
+            log.info("Inserted point at (%.2f, %.2f, %.2f)", x, y, z)
+            self.view.sync()
 
 
 app = OctreeApp()